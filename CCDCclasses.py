@@ -3,9 +3,15 @@
 #
 # Matthew Grossman from Princeton HCIL - Jun. 5, 2018
 import win32com.client
-import Camera_ctrl
+from Camera_ctrl import Camera_ctrl
+from frameStacker import FrameStacker
+from acquisitionPipeline import AcquisitionPipeline
+from darkLibrary import DarkLibrary, darkKey
+from darkModel import DarkModel
 import numpy
-import os
+
+# folder the master dark frames are kept in between sessions
+darkFolder = 'C:/Lab/FPWC/hardware/darks'
 
 class Camera:
     """ A class that mimics the handle class from for cameras matlab and
@@ -33,8 +39,9 @@ class OldCamera:
         self.newDarkFrame
         self.exposure
 
-def initializeCamera(camera):
-    """ A function that initializes the camera for use"""
+def initializeCamera(camera, darkFolder=darkFolder):
+    """ A function that initializes the camera for use. Dark frames are
+    reused from the library in darkFolder unless a new one is needed"""
     # connects the computer to camera and saves the handle
     camera.handle = Camera_ctrl(0, 'enable')
     # enables the camera and sets up its temperature
@@ -45,14 +52,19 @@ def initializeCamera(camera):
     # sets up the camera properties
     Camera_ctrl(camera.handle, 'exposureproperties', camera.startPosition,
                 camera.imageSize, (camera.binXi, camera.binEta))
-    # take new dark frame if needed
-    if camera.newDarkFrame() == True:
-        numIm = 30
-        camera.darkFrame = takeDarkCam(camera.handle, camera.exposrure, numIm,
-                                   camera.binXi, camera.binEta)
-    else:
-# how will the darkCam file be read now? is it still a .mat file now???
-        camera.darkFrame = darkCam
+    # take new dark frame if needed, otherwise load it from the library
+    camera.handle.darkLibrary = DarkLibrary(darkFolder)
+    numIm = 30
+    camera.darkFrame = takeDarkCam(camera.handle, camera.exposure, numIm,
+                                   camera.binXi, camera.binEta,
+                                   camera.newDarkFrame() == True)
+    camera.darkExposure = camera.exposure
+    # fit a dark model so darks for other exposure times need no exposures
+    camera.darkModel = DarkModel.fromLibrary(camera.handle.darkLibrary,
+                                             labDarkKey(camera.handle,
+                                                        camera.exposure,
+                                                        camera.binXi,
+                                                        camera.binEta))
 
 def finalizeCamera(camera):
     """ A function that shuts down the camera """
@@ -60,33 +72,62 @@ def finalizeCamera(camera):
     Camera_ctrl(camera.handle, 'finalize')
     Camera_ctrl(camera.handle, 'disable')
     
-def takeImg(h, num, exptime, start_pos, size_pixels, bin_pixels):
+def takeImg(h, num, exptime, start_pos, size_pixels, bin_pixels, clip=None,
+            process=None, workers=1):
     """ A function that takes an image. h is a handle, num is an integer,
-    start_pos, size_pixels, and bin_pixels are all tuples"""
+    start_pos, size_pixels, and bin_pixels are all tuples. If clip is given,
+    pixel values more than clip sigmas from the running mean are rejected.
+    If process is given, each frame is replaced by process(frame) on one of
+    workers threads while the next frame is exposed"""
     Camera_ctrl(h, 'exposureproperties', start_pos, size_pixels, bin_pixels)
-    tempImg = numpy.zeros((size_pixels[1], size_pixels[0]), numpy.int32)
-    for i in range(num):
-        currentImg = Camera_ctrl(h, 'exposure', exptime)
-        tempImg += currentImg
-    img = (1 / num) * tempImg
-    return img
-    
-def takeDarkCam(h_camera, exptime, numIm,  BinX, BinY):
-    folder = os.getcwd()
-    
-    h_camera = Camera_ctrl(h_camera, 'shutter', 0)
-    Camera_ctrl(h_camera, 'shuttepriority', 0)
-    Camera_ctrl(h_camera, 'readoutspeed', 0)
+    # accumulates each frame in place on a worker thread
+    stack = FrameStacker(clip = clip)
+    pipe = AcquisitionPipeline(lambda: Camera_ctrl(h, 'exposure', exptime),
+                               process, stack.add, workers)
+    # frames waiting in the pipeline must not be overwritten in the ring
+    if h.ringDepth < pipe.inFlight():
+        h.ringDepth = pipe.inFlight()
+        h.ring = None
+    h.lastAcquisition = pipe.run(num)
+    h.lastStack = stack
+    return stack.mean
     
+def labDarkKey(h_camera, exptime, BinX, BinY):
+    """ A function that returns the dark library key of the darks
+    takeDarkCam takes at exposure time exptime"""
+    return darkKey(exptime, (BinX, BinY), (0, 0), (500, 500), 0,
+                   h_camera.ccdtemp)
+
+def storedDark(h_camera, exptime, BinX, BinY):
+    """ A function that returns the dark of exposure time exptime stored
+    in the darkLibrary of h_camera, or None if there is none"""
+    if getattr(h_camera, 'darkLibrary', None) is None:
+        return None
+    return h_camera.darkLibrary.lookup(labDarkKey(h_camera, exptime, BinX,
+                                                  BinY))
+
+def takeDarkCam(h_camera, exptime, numIm,  BinX, BinY, retake=False):
+    """ A function that takes an averaged dark frame. If h_camera has a
+    darkLibrary holding a dark with the same settings, that dark is returned
+    instead unless retake is True, and new darks are saved to it"""
     start_pos = (0, 0)
     bin_pixels = (BinX, BinY)
     size_pixels = (500, 500)
     
+    key = labDarkKey(h_camera, exptime, BinX, BinY)
+    if h_camera.darkLibrary != None and not retake:
+        darkCam = h_camera.darkLibrary.lookup(key)
+        if darkCam is not None:
+            return darkCam
+    
+    h_camera = Camera_ctrl(h_camera, 'shutter', 0)
+    Camera_ctrl(h_camera, 'shutterpriority', 0)
+    Camera_ctrl(h_camera, 'readoutspeed', 0)
+    
     darkCam = takeImg(h_camera, numIm, exptime, start_pos, size_pixels,
                       bin_pixels)
     
-    os.chdir('C:\Lab\FPWC\hardware')
-# ASK FORMAT FOR SAVING PICTURE. THEN SAVE HERE
-    os.chdir(folder)
+    if h_camera.darkLibrary != None:
+        h_camera.darkLibrary.store(key, darkCam, numIm)
     return darkCam
     
@@ -14,6 +14,8 @@
 #       camera.setup()
 #    Initilialization:
 #        camera.init(ccdtemp) # ccdtemp range: (-50, 50)
+#        # settings are written through camera.state, which skips writes of
+#        # values the camera already has and is reset on every connect
 #    Stop fan and cooler:
 #        camera.finalize()
 #    Disable the camera:
@@ -34,17 +36,59 @@
 #    Take a picture:
 #        img = camera.exposure(expTime)
 #        # exptime is the exposure time you can change
+#        # camera.lastTiming holds the wait and readout times of the last
+#        # exposure, camera.exposureTimeout bounds the wait (None picks a
+#        # default from the exposure time) and camera.cancel.set() aborts it
+#        # img is a uint16 frame from camera.ring, which is reused after
+#        # camera.ringDepth more exposures, so copy it if it has to be kept
 #    Take an average image:
 #        img = camera.avgimg(expTime, numIm)
 #        # takes numIm exposures of exposure time expTime and averages them
+#        img = camera.avgimg(expTime, numIm, clip)
+#        # also rejects pixel values more than clip sigmas from the mean,
+#        # camera.lastStack.variance() gives the per-pixel variance
+#        img = camera.avgimg(expTime, numIm, clip, process, workers)
+#        # exposes the next frame while process(frame) runs on workers
+#        # threads, camera.lastAcquisition holds the time per frame
+#    Take a master dark frame:
+#        darkCam = camera.takeDarkCam(expTime, numIm, BinX, BinY)
+#        # if camera.darkLibrary is a DarkLibrary, a stored dark with the
+#        # same settings is returned instead, and new darks are stored in it
+#    Synthesize a dark from the darks already in camera.darkLibrary:
+#        darkCam = camera.syntheticDark(expTime, BinX, BinY)
+#        # None if fewer than two exposure times have been stored
+#    Take a high dynamic range image:
+#        rate, saturated = camera.bracket(expTimes, numIm)
+#        # takes numIm exposures at each exposure time and merges them into
+#        # counts per second, subtracting darks from camera.darkLibrary,
+#        # which must hold a dark (or darks at two exposure times) taken
+#        # with takeDarkCam at the current binning
 #    Show camera realtime picture:
 #        camera.realtime()
 #        # can be used during calibration 
+#        camera.realtime(maxPixels)
+#        # frames are shown at most maxPixels on a side (default 512)
 
-from matplotlib import pyplot as plt
 import numpy as np
 import win32com.client
-import os
+import threading
+from exposureWait import waitForImage, timedReadout
+from frameBuffer import FrameRing
+from frameStacker import FrameStacker
+from acquisitionPipeline import AcquisitionPipeline
+from darkLibrary import darkKey
+from darkModel import DarkModel
+from realtimeViewer import RealtimeViewer
+from cameraState import CameraState
+from hdrMerge import HDRMerge
+from autoExposure import saturationLevel
+
+# the readout speed avgimg takes every image at, darks included, and so
+# the one darks are stored under in the dark library
+avgReadout = 'fastReadout'
+# the region takeDarkCam takes darks of, other regions are cropped from it
+darkStart = (0, 0)
+darkSize = (500, 500)
 
 class Camera:
     """
@@ -60,6 +104,7 @@ class Camera:
         """
         
         self.handle = None
+        self.state = None
         self.serialnum = '0'
         self.shutterStatus = True
         self.startPos = (0, 0)
@@ -67,6 +112,16 @@ class Camera:
         self.binPix = (0, 0)
         self.ccdtemp = None
         self.name = ''
+        self.exposureTimeout = None
+        self.cancel = threading.Event()
+        self.lastTiming = None
+        self.ringDepth = 4
+        self.ring = None
+        self.lastStack = None
+        self.lastAcquisition = None
+        self.darkLibrary = None
+        self.darkModels = {}
+        self.saturation = saturationLevel
 
     def connect(self):
         """
@@ -85,6 +140,8 @@ class Camera:
             else:
                 print(self.handle.__class__.__name__ +
                       'is already connected.')
+            # settings cached from an earlier connection can't be trusted
+            self.state = CameraState(self.handle)
             # get camera default peramters
             self.serialnum = self.handle.SerialNumber;
             self.defaultsizepixels = (self.handle.Numx, self.handle.NumY)
@@ -113,6 +170,7 @@ class Camera:
         self.disable()
         print('Disconnecting ' + self.handle.__class__.__name__)
         self.handle = None
+        self.state = None
     
     def init(self, ccdtemp):
         """
@@ -123,24 +181,20 @@ class Camera:
         if (ccdtemp < -50) or (ccdtemp > 50):
             raise ValueError('Temperature is not in the correct range.')
         # sets the current camera as the main camera
-        if self.handle.IsMainCamera == False:
-            self.handle.IsMainCamera = True
+        self.state.set('IsMainCamera', True)
         # turns on the camera fan
-        if self.handle.FanMode != 'FanFull':
-            self.handle.FanMode = 'FanFull'
+        self.state.set('FanMode', 'FanFull')
         # enable the CCD cooler
-        if self.handle.CoolerOn != True:
-            self.handle.CoolerOn = True
+        self.state.set('CoolerOn', True)
         # set camera cooling temperature and update ccdtemp attribute
-        if self.handle.CanSetCCDTemperature == True:
-            self.handle.SetCCDTemperature = ccdtemp
-            self.ccdtemp = self.handle.SetCCDTemperature
+        if self.state.get('CanSetCCDTemperature') == True:
+            self.state.set('SetCCDTemperature', ccdtemp)
+            self.ccdtemp = self.state.get('SetCCDTemperature')
         # set camera gain to self gain
-        if self.handle.CameraGain != 'CameraGainLow':
-            self.handle.CameraGain = 'CameraGainLow'
+        self.state.set('CameraGain', 'CameraGainLow')
         # set camera shutter priority to electrical
         # 0 for mechanical, 1 for electical
-        self.handle.ShutterPriority = 1
+        self.state.set('ShutterPriority', 1)
     
     def shutter(self, openflag):
         """
@@ -151,17 +205,18 @@ class Camera:
             raise Exception('Camera not connected.')
         if openflag == True:
             # Set the camera to manual shutter mode.
-            self.handle.ManualShutterMode = True
+            self.state.set('ManualShutterMode', True)
             # Open the shutter as specified
-            self.handle.ManualShutterOpen = True
+            self.state.set('ManualShutterOpen', True)
             self.shutterStatus = True
         elif openflag == False:
-            # Set the camera to manual shutter mode
-            self.handle.ManualShutterMode = True
-            # Close the shutter as specified
-            self.handle.ManualShutterOpen = False
+            # Close the shutter unless it is known to be closed already,
+            # which needs manual shutter mode
+            if self.state.values.get('ManualShutterOpen') != False:
+                self.state.set('ManualShutterMode', True)
+                self.state.set('ManualShutterOpen', False)
             # Set the camera to auto shutter mode
-            self.handle.ManualShutterMode = False
+            self.state.set('ManualShutterMode', False)
             self.shutterStatus = False;
         else:
             raise ValueError('Openflag must be True or False.')
@@ -173,56 +228,143 @@ class Camera:
         """
         if self.handle == None:
             raise Exception('Camera not connected.')
-        if len(startPos) != 2:
-            raise ValueError('Wrong dimension of start position')
-        if len(imgSize) != 2:
-            raise ValueError('Wrong dimension of picture size')  
-        if len(binPix) != 2:
-            raise ValueError('Wrong dimension of binned pixels')
-        # sends the exposure properties to the camera
-        self.handle.StartX = startPos[0]
-        self.handle.StartY = startPos[1]
-        self.handle.NumX = imgSize[0]
-        self.handle.NumY = imgSize[1]
-        self.handle.BinX = binPix[0]
-        self.handle.BinY = binPix[1]
+        # checks and sends the changed exposure properties to the camera
+        self.state.exposureproperties(startPos, imgSize, binPix)
         # update the camera attributes
-        self.startPos = (self.handle.StartX, self.handle.StartY)
-        self.imgSize = (self.handle.NumX, self.handle.Numy)
-        self.binPix = (self.handle.BinX, self.handle.BinY)
+        self.startPos = (self.state.get('StartX'), self.state.get('StartY'))
+        self.imgSize = (self.state.get('NumX'), self.state.get('NumY'))
+        self.binPix = (self.state.get('BinX'), self.state.get('BinY'))
+        # preallocate the frames readouts of this size are copied into
+        if self.ring == None or self.ring.shape != (self.imgSize[1],
+                                                    self.imgSize[0]):
+            self.ring = FrameRing((self.imgSize[1], self.imgSize[0]),
+                                  self.ringDepth)
     
-    def avgimg(self, expTime, numIm):
+    def avgimg(self, expTime, numIm, clip = None, process = None,
+               workers = 1):
         """
         Uses this class's exposure function to take numIm imgaes of exposure
-        time expTime. It then returns the mean of the images.
+        time expTime. It then returns the mean of the images. If clip is
+        given, pixel values more than clip sigmas from the running mean are
+        left out of the average. If process is given, each frame is replaced
+        by process(frame) before it is averaged. The next exposure is taken
+        while workers threads process and average the previous frames. The
+        stack is kept in lastStack.
         """
         if self.handle == None:
             raise Exception('Camera not connected.')
-        self.handle.ReadoutSpeed = 'fastReadout'
-        img = np.zeros((self.imgSize[1], self.imgSize[0]), np.int32)
-        for i in range(numIm):
-            img = img + self.exposure(expTime)
-        return img / numIm
+        self.state.set('ReadoutSpeed', avgReadout)
+        # accumulates each frame in place on a worker thread
+        self.lastStack = FrameStacker(clip = clip)
+        pipe = AcquisitionPipeline(lambda: self.exposure(expTime), process,
+                                   self.lastStack.add, workers)
+        # frames waiting in the pipeline must not be overwritten in the ring
+        if self.ringDepth < pipe.inFlight():
+            self.ringDepth = pipe.inFlight()
+            self.ring = None
+        self.lastAcquisition = pipe.run(numIm)
+        return self.lastStack.mean
     
-    def takeDarkCam(self, expTime, numIm, BinX, BinY):
+    def takeDarkCam(self, expTime, numIm, BinX, BinY, retake = False):
         """
         Takes DarkCam image using avgimg function. It saves the image and then
-        returns it
+        returns it. If darkLibrary is set and holds a dark taken with the
+        same settings, that dark is returned instead unless retake is True.
         """
-        # get the current directory and set it to folder
-        folder = os.getcwd()
+        key = darkKey(expTime, (BinX, BinY), darkStart, darkSize, avgReadout,
+                      self.ccdtemp)
+        if self.darkLibrary != None and not retake:
+            darkCam = self.darkLibrary.lookup(key)
+            if darkCam is not None:
+                return darkCam
         # set the properties necessary to take dark image
         self.shutter(False)
         self.shutterpriority(0)
         self.readoutspeed(0)
-        self.exposureproperties((0,0,), (500, 500), (BinX, BinY))
+        self.exposureproperties(darkStart, darkSize, (BinX, BinY))
         # take dark image
         darkCam = self.avgimg(expTime, numIm)
         # save picture
-        os.chdir('C:\Lab\FPWC\hardware')
-######### get format for saving picture and then save it
-        os.chdir(folder)
+        if self.darkLibrary != None:
+            self.darkLibrary.store(key, darkCam, numIm)
+            # the dark models are out of date now
+            self.darkModels = {}
         return darkCam
+
+    def darkFor(self, expTime):
+        """
+        Returns the dark for exposure time expTime at the current binning
+        from darkLibrary, synthesizing it from the stored darks if there is
+        none for that exposure time, cropped from the region takeDarkCam
+        takes darks of to the current one. Raises an Exception if there is
+        no library, no dark for these settings or the current region is
+        not inside the dark region.
+        """
+        if self.darkLibrary == None:
+            raise Exception('Camera has no dark library.')
+        rows = slice(self.startPos[1] - darkStart[1],
+                     self.startPos[1] - darkStart[1] + self.imgSize[1])
+        cols = slice(self.startPos[0] - darkStart[0],
+                     self.startPos[0] - darkStart[0] + self.imgSize[0])
+        if (rows.start < 0 or cols.start < 0 or rows.stop > darkSize[1] or
+                cols.stop > darkSize[0]):
+            raise Exception('Region ' + str((self.startPos, self.imgSize)) +
+                            ' is outside the dark region ' +
+                            str((darkStart, darkSize)) + '.')
+        key = darkKey(expTime, self.binPix, darkStart, darkSize, avgReadout,
+                      self.ccdtemp)
+        darkCam = self.darkLibrary.lookup(key)
+        if darkCam is not None:
+            return darkCam[rows, cols]
+        settings = (self.binPix[0], self.binPix[1], self.ccdtemp)
+        if self.darkModels.get(settings) == None:
+            self.darkModels[settings] = DarkModel.fromLibrary(
+                    self.darkLibrary, key)
+        if self.darkModels[settings] == None:
+            raise Exception('No dark for ' + str(expTime) + ' s at binning ' +
+                            str(self.binPix) + ', take one with takeDarkCam.')
+        return self.darkModels[settings].synthesize(expTime)[rows, cols]
+
+    def bracket(self, expTimes, numIm = 1):
+        """
+        Takes numIm images at every exposure time in expTimes and merges
+        them into one high dynamic range image in counts per second. Each
+        pixel is averaged over the exposures it is not saturated in
+        (averaged value below self.saturation), weighted by exposure time.
+        Exposures are taken shortest first, and the dark of each one comes
+        from darkLibrary (see darkFor), all of them found before any
+        exposure is taken. Returns the image and a mask of the pixels that
+        are saturated in every exposure.
+        """
+        if self.handle == None:
+            raise Exception('Camera not connected.')
+        merge = HDRMerge(self.saturation)
+        # only the exposure time changes between exposures, each once
+        expTimes = sorted(set(expTimes))
+        darks = [self.darkFor(expTime) for expTime in expTimes]
+        for expTime, darkCam in zip(expTimes, darks):
+            img = self.avgimg(expTime, numIm)
+            merge.add(img, expTime, darkCam)
+        return merge.result()
+
+    def syntheticDark(self, expTime, BinX, BinY):
+        """
+        Returns a dark for exposure time expTime computed from a bias plus
+        dark current model fitted to the darks in darkLibrary, without
+        taking any exposures. Returns None if the library does not hold
+        darks at two or more exposure times for these settings.
+        """
+        if self.darkLibrary == None:
+            raise Exception('Camera has no dark library.')
+        settings = (BinX, BinY, self.ccdtemp)
+        if self.darkModels.get(settings) == None:
+            key = darkKey(expTime, (BinX, BinY), darkStart, darkSize,
+                          avgReadout, self.ccdtemp)
+            self.darkModels[settings] = DarkModel.fromLibrary(
+                    self.darkLibrary, key)
+        if self.darkModels[settings] == None:
+            return None
+        return self.darkModels[settings].synthesize(expTime)
     
     def exposure(self, expTime):
         """
@@ -231,29 +373,32 @@ class Camera:
         if self.handle == None:
             raise Exception('Camera not connected.')
         # Starts an exposure on the camera
+        self.cancel.clear()
         self.handle.StartExposure(expTime, self.shutterStatus)
-        # Wait for the exposure to complete
-        done = self.handle.ImageReady
-        while done != True:
-            done = self.handle.ImageReady
+        # Wait for the exposure to complete, sleeping through most of it
+        timing = waitForImage(self.handle, expTime, self.exposureTimeout,
+                              self.cancel)
 #HOW WILL THE SAFEARRAY COME OUT?
         # gets the image from the camera as some form of array
-        return self.handle.ImageArray
+        raw, timing['readout'] = timedReadout(self.handle)
+        # copies the image into the next preallocated frame
+        if self.ring == None:
+            self.ring = FrameRing((self.state.get('NumY'),
+                                   self.state.get('NumX')), self.ringDepth)
+        img = self.ring.transfer(raw)
+        self.lastTiming = timing
+        return img
     
-    def realtime(self):
+    def realtime(self, maxPixels = 512):
         """
         Uses the exposure function of this class to display a realitme feed
         of the camera. The feed will end when the figure window is closed.
+        Frames are taken on this thread and shown at most maxPixels on a
+        side.
         """
-       # creates the figure
-        plt.figure(100)
-        plt.title('Real Time Picture')
-        plt.tight_layout()
-        # updates the figure with the current image until the figure is closed
-        while plt.fignum_exists(100):
-            img = self.exposure(0.0003)
-            plt.imshow(img)
-            plt.pause(.05)
+        # updates the figure with the newest image until the figure is closed
+        viewer = RealtimeViewer(lambda: self.exposure(0.0003), 100, maxPixels)
+        viewer.run()
     
     def readoutspeed(self, readoutflag):
         """
@@ -263,7 +408,7 @@ class Camera:
         if self.handle == None:
             raise Exception('Camera not connected.')
         # sends the readout speed to the camera
-        self.handle.ReadoutSpeed = readoutflag
+        self.state.set('ReadoutSpeed', readoutflag)
         
     def shutterpriority(self, shutterflag):
         """
@@ -273,7 +418,7 @@ class Camera:
         if self.handle == None:
             raise Exception('Camera not connected.')
         # sends the shutter pririty to the camera
-        self.handle.ShutterPriority = shutterflag
+        self.state.set('ShutterPriority', shutterflag)
     
     def finalize(self):
         """
@@ -283,11 +428,9 @@ class Camera:
         if self.handle == None:
             raise Exception('Camera not connected.')
         # turn off the camera fan
-        if self.handle.FanMode != 'FanOff':
-            self.handle.FanMode = 'FanOff'
+        self.state.set('FanMode', 'FanOff')
         # disable the CCD cooler
-        if self.handle.CoolerOn != False:
-            self.handle.CoolerOn = False
+        self.state.set('CoolerOn', False)
         # closes the shutter
         self.shutter(False)
         self.shutterStatus = False
@@ -301,6 +444,9 @@ class Camera:
         # disconnects camera
         if self.handle.Connected == True:
             self.handle.Connected = False
+        # the cached settings are stale once the camera is disconnected
+        if self.state != None:
+            self.state.invalidate()
     
     def setup(self):
         """
@@ -8,6 +8,8 @@
 #        h = Camera_ctrl(0, 'enable')
 #    Initilialization:
 #        Camera_ctrl(h, 'init', temperature) # temperature range: (-50, 50)
+#        # settings are written through h.state, which skips writes of
+#        # values the camera already has and is reset on every connect
 #    Stop fan and cooler:
 #        Camera_ctrl(h, 'finalize')
 #    Disable the handle:
@@ -26,12 +28,20 @@
 #        # shutterflag: 0 for mechanical, 1 for electrical
 #    Take pictures: img = Camera_ctrl(h, 'exposure', exptime)
 #        # exptime is the exposure time you can change
+#        # img is a uint16 frame from camera.ring, which is reused after
+#        # camera.ringDepth more exposures, so copy it if it has to be kept
 #    Show camera realtime picture: Camera_ctrl(h, 'realtime')
 #        # can be used during calibration
+#        Camera_ctrl(h, 'realtime', maxPixels)
+#        # frames are shown at most maxPixels on a side (default 512)
 
-from matplotlib import pyplot as plt
 import numpy
 import win32com.client
+from exposureWait import waitForImage, timedReadout
+from frameBuffer import FrameRing
+from frameStacker import FrameStacker
+from realtimeViewer import RealtimeViewer
+from cameraState import CameraState
 
 class Camera:
     """ A class that mimics the handle class from for cameras matlab and
@@ -40,12 +50,21 @@ class Camera:
        """
     def __init__(self):
         self.handle = None
+        self.state = None
         self.serialnum = '0'
         self.shutter = True
         self.startPos = (0, 0)
         self.imgSize = (0, 0)
         self.binPix = (0, 0)
         self.ccdtemp = None
+        self.exposureTimeout = None
+        self.cancel = None
+        self.lastTiming = None
+        self.ringDepth = 4
+        self.ring = None
+        self.lastStack = None
+        self.lastAcquisition = None
+        self.darkLibrary = None
 
 def Camera_ctrl(camera, cmd, *args):
     
@@ -59,10 +78,12 @@ def Camera_ctrl(camera, cmd, *args):
                 camera.handle = win32com.client.Dispatch('QSICamera.CCDCamera')
             # connect the camera
             if camera.handle.Connected == False:
-                camera.camera.Connected = True
+                camera.handle.Connected = True
                 print('Connecting ' + camera.handle.__class__.__name__)
             else:
                 print(camera.handle.__class__.__name__ + 'is already connected.')
+            # settings cached from an earlier connection can't be trusted
+            camera.state = CameraState(camera.handle)
             # get camera dfault peramters
             camera.serialnum = camera.handle.SerialNumber;
             camera.defaultsizepixels = (camera.handle.Numx, camera.handle.NumY)
@@ -84,6 +105,7 @@ def Camera_ctrl(camera, cmd, *args):
         Camera_ctrl(camera, 'disable')
         print('Disconnecting ' + camera.handle.__class__.__name__)
         camera.handle = None
+        camera.state = None
         return camera
     
     elif cmd == 'init':
@@ -92,26 +114,22 @@ def Camera_ctrl(camera, cmd, *args):
         if n_argin != 1:
             raise ValueError('Wrong number of input arguments')
         # sets the current camera as the main camera
-        if camera.handle.IsMainCamera == False:
-            camera.handle.IsMainCamera = True
+        camera.state.set('IsMainCamera', True)
         # turns on the camera fan
-        if camera.handle.FanMode != 'FanFull':
-            camera.handle.FanMode = 'FanFull'
+        camera.state.set('FanMode', 'FanFull')
         # enable the CCD cooler
-        if camera.handle.CoolerOn != True:
-            camera.handle.CoolerOn = True
+        camera.state.set('CoolerOn', True)
         # set camera cooling temperature and update ccdtemp attribute
         ccdtempc = args[0]
-        if camera.handle.CanSetCCDTemperature == True:
-            camera.handle.SetCCDTemperature = ccdtempc
-            camera.ccdtemp = camera.handle.SetCCDTemperature
+        if camera.state.get('CanSetCCDTemperature') == True:
+            camera.state.set('SetCCDTemperature', ccdtempc)
+            camera.ccdtemp = camera.state.get('SetCCDTemperature')
         # set camera gain to low gain
-        if camera.handle.CameraGain != 'CameraGainLow':
-            camera.handle.CameraGain = 'CameraGainLow'
-            # set camera shutter priority to electrical
-            # 0 for mechanical, 1 for electical
-            camera.handle.ShutterPriority = 1
-            return camera
+        camera.state.set('CameraGain', 'CameraGainLow')
+        # set camera shutter priority to electrical
+        # 0 for mechanical, 1 for electical
+        camera.state.set('ShutterPriority', 1)
+        return camera
             
     elif cmd == 'shutter':
         if camera.handle == None:
@@ -121,17 +139,18 @@ def Camera_ctrl(camera, cmd, *args):
         openflag = args[0]
         if openflag == True:
             # Set the camera to manual shutter mode.
-            camera.handle.ManualShutterMode = True
+            camera.state.set('ManualShutterMode', True)
             # Open the shutter as specified
-            camera.handle.ManualShutterOpen = True
+            camera.state.set('ManualShutterOpen', True)
             camera.shutter = True
         else:
-            # Set the camera to manual shutter mode
-            camera.handle.ManualShutterMode = True
-            # Close the shutter as specified
-            camera.handle.ManualShutterOpen = False
+            # Close the shutter unless it is known to be closed already,
+            # which needs manual shutter mode
+            if camera.state.values.get('ManualShutterOpen') != False:
+                camera.state.set('ManualShutterMode', True)
+                camera.state.set('ManualShutterOpen', False)
             # Set the camera to auto shutter mode
-            camera.handle.ManualShutterMode = False
+            camera.state.set('ManualShutterMode', False)
             camera.shutter = False;
         return camera
     
@@ -143,37 +162,34 @@ def Camera_ctrl(camera, cmd, *args):
         startPos = args[0]
         imgSize = args[1]
         binPix = args[2]
-        if len(startPos) != 2:
-            raise ValueError('Wrong dimension of start position')
-        if len(imgSize) != 2:
-            raise ValueError('Wrong dimension of picture size')  
-        if len(binPix) != 2:
-            raise ValueError('Wrong dimension of binned pixels')
-        # sends the exposure properties to the camera
-        camera.handle.StartX = startPos[0]
-        camera.handle.StartY = startPos[1]
-        camera.handle.NumX = imgSize[0]
-        camera.handle.NumY = imgSize[1]
-        camera.handle.BinX = binPix[0]
-        camera.handle.BinY = binPix[1]
+        # checks and sends the changed exposure properties to the camera
+        camera.state.exposureproperties(startPos, imgSize, binPix)
         # update the camera attributes
-        camera.startPos = (camera.handle.StartX, camera.handle.StartY)
-        camera.imgSize = (camera.handle.NumX, camera.handle.Numy)
-        camera.binPix = (camera.handle.BinX, camera.handle.BinY)
+        camera.startPos = (camera.state.get('StartX'),
+                           camera.state.get('StartY'))
+        camera.imgSize = (camera.state.get('NumX'), camera.state.get('NumY'))
+        camera.binPix = (camera.state.get('BinX'), camera.state.get('BinY'))
+        # preallocate the frames readouts of this size are copied into
+        if camera.ring == None or camera.ring.shape != (camera.imgSize[1],
+                                                        camera.imgSize[0]):
+            camera.ring = FrameRing((camera.imgSize[1], camera.imgSize[0]),
+                                    camera.ringDepth)
         return camera
     
     elif cmd == 'avgimg':
         if camera.handle == None:
             raise Exception('Camera not connected.')
-        if n_argin != 2:
+        if n_argin != 2 and n_argin != 3:
             raise ValueError('Wrong number of input arguments')
-        camera.handle.ReadoutSpeed = camera.fastReadout
+        camera.state.set('ReadoutSpeed', camera.fastReadout)
         expTime = args[0]
         numIm = args[1]
-        img = numpy.zeros((camera.imgSize[1], camera.imgSize[0]), numpy.int32)
+        clip = args[2] if n_argin == 3 else None
+        # accumulates each frame in place as it is read out
+        camera.lastStack = FrameStacker(clip = clip)
         for i in range(numIm):
-            img = img + Camera_ctrl(camera, 'exposure', expTime)
-        return img / numIm
+            camera.lastStack.add(Camera_ctrl(camera, 'exposure', expTime))
+        return camera.lastStack.mean
     
     elif cmd == 'exposure':
         if camera.handle == None:
@@ -182,25 +198,28 @@ def Camera_ctrl(camera, cmd, *args):
             raise ValueError('Wrong number of input arguments')
         exptime = args[0]
         # Starts an exposure on the camera
-        camera.shutter.StartExposure(exptime, camera.shutter)
-        # Wait for the exposure to complete
-        done = camera.handle.ImageReady
-        while done != True:
-            done = camera.handle.ImageReady
+        camera.handle.StartExposure(exptime, camera.shutter)
+        # Wait for the exposure to complete, sleeping through most of it
+        timing = waitForImage(camera.handle, exptime,
+                              camera.exposureTimeout, camera.cancel)
 #HOW WILL THE SAFEARRAY COME OUT?
         # gets the image from the camera as some form of array
-        return camera.handle.ImageArray
+        raw, timing['readout'] = timedReadout(camera.handle)
+        # copies the image into the next preallocated frame
+        if camera.ring == None:
+            camera.ring = FrameRing((camera.state.get('NumY'),
+                                     camera.state.get('NumX')),
+                                    camera.ringDepth)
+        img = camera.ring.transfer(raw)
+        camera.lastTiming = timing
+        return img
     
     elif cmd == 'realtime':
-        # creates the figure
-        plt.figure(100)
-        plt.title('Real Time Picture')
-        plt.tight_layout()
-        # updates the figure with the current image until the figure is closed
-        while plt.fignum_exists(100):
-            img = Camera_ctrl(camera, 'exposure', 0.0003)
-            plt.imshow(img)
-            plt.pause(.1)
+        maxPixels = args[0] if n_argin == 1 else 512
+        # updates the figure with the newest image until the figure is closed
+        viewer = RealtimeViewer(lambda: Camera_ctrl(camera, 'exposure', 0.0003),
+                                100, maxPixels)
+        viewer.run()
         
     elif cmd == 'readoutspeed':
         if camera.handle == None:
@@ -209,7 +228,7 @@ def Camera_ctrl(camera, cmd, *args):
             raise ValueError('Wrong number of input arguments')
         readoutflag = args[0]
         # sends the readout speed to the camera
-        camera.handle.ReadoutSpeed = readoutflag      
+        camera.state.set('ReadoutSpeed', readoutflag)
                 
     elif cmd == 'shutterpriority':
         if camera.handle == None:
@@ -218,17 +237,15 @@ def Camera_ctrl(camera, cmd, *args):
             raise ValueError('Wrong number of input arguments')
         shutterflag = args[0]
         # sends the shutter pririty to the camera
-        camera.handle.ShutterPriority = shutterflag
+        camera.state.set('ShutterPriority', shutterflag)
 
     elif cmd == 'finalize':
         if camera.handle == None:
             raise Exception('Camera not connected.')
         # turn off the camera fan
-        if camera.handle.FanMode != 'FanOff':
-            camera.handle.FanMode = 'FanOff'
+        camera.state.set('FanMode', 'FanOff')
         # disable the CCD cooler
-        if camera.handle.CoolerOn != False:
-            camera.handle.CoolerOn = False
+        camera.state.set('CoolerOn', False)
         # closes the shutter
         Camera_ctrl(camera, 'shutter', False)
         camera.shutter = False
@@ -239,5 +256,8 @@ def Camera_ctrl(camera, cmd, *args):
         # disconnects camera
         if camera.handle.Connected == True:
             camera.handle.Connected = False
+        # the cached settings are stale once the camera is disconnected
+        if camera.state != None:
+            camera.state.invalidate()
     else:
         print('unkown command: ' + cmd)
\ No newline at end of file
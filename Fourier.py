@@ -4,22 +4,196 @@ Created on Fri Jun  8 13:49:20 2018
 
 @author: matthewgrossman
 """
+# Fourier - focal plane images of pupil images, from the command line
+#
+# For every pupil image given (text or .npy files, or glob patterns of
+# them) the image is transposed, padded to 2**resolution and transformed,
+# and abs of the shifted transform divided by its maximum is written to the
+# output folder as .npy, .txt or .png, under the same relative path as the
+# pupil has below the folder common to all the inputs, so files of the same
+# name in different folders do not overwrite each other. With --crop only
+# the central crop x crop pixels are kept, and only they are computed (see
+# matrixFourier.py), which is much faster than the full plane. Files are
+# processed in parallel and every result is written as soon as it is done,
+# so a long run can be followed or interrupted. Nothing is plotted unless
+# --show is given, so it runs on a machine without a display.
+#
+#Brief Usage:
+#    From the command line:
+#        python Fourier.py data/*.txt --resolution 12 --format npy --out focal
+#        python Fourier.py pupil.txt --crop 512 --format png --workers 4
+#        python Fourier.py pupil.txt --show
+#        # shows the pupil and its focal plane like the old script
+#    From Python:
+#        F1 = focalImage('pupil.txt', resolution = 12)
+#        written = process(['data/*.txt'], 'focal', resolution = 11)
 
-from matplotlib import pyplot as ppl
+import argparse
+import glob
+import os
+import time
+from multiprocessing import Pool
 import numpy as np
-ppl.close('all')
-P = np.loadtxt('//mac/Home/Desktop/ripple3_256x256_ideal_undersized.txt')
-P = np.transpose(P)
-ppl.figure()
-ppl.imshow(P, origin = 'lower', cmap = 'gray')
-
-N=2**12
-P1 = np.zeros((N,N))
-P1[int((N-np.size(P,0))/2):int((N+np.size(P,0))/2),int((N-np.size(P,1))/2):int((N+np.size(P,1))/2)] = P
-
-#x = np.array(P, dtype='float')
-F = np.fft.fftshift(np.fft.fft2(np.fft.fftshift(P1)))
-
-F1 = abs(F)/np.max(np.max(abs(F)))
-ppl.figure()
-ppl.imshow(F1, origin = 'lower', cmap = 'jet')
\ No newline at end of file
+from fourierPropagation import focalPlane
+from imageCache import loadImage
+from matrixFourier import FocalPlane
+
+formats = ('npy', 'txt', 'png')
+
+
+def focalImage(source, resolution = 12, crop = None):
+    """
+    Returns the normalized focal plane of the pupil image source (an array
+    or a file) padded to 2**resolution, or its central crop x crop pixels.
+    """
+    P = np.transpose(loadImage(source))
+    N = 2**resolution
+    if crop is None or crop >= N:
+        return focalPlane(P, N).copy()
+    # the full plane is normalized by its maximum, the zero frequency term
+    # for non-negative pupils, and so is FocalPlane
+    start = N // 2 - crop // 2
+    return FocalPlane(P, N)[start:start + crop, start:start + crop]
+
+
+def expand(patterns):
+    """
+    Returns the sorted files matching the glob patterns, keeping plain
+    names that exist. Raises a ValueError if nothing matches.
+    """
+    files = []
+    for pattern in patterns:
+        matches = glob.glob(pattern)
+        files.extend(sorted(matches) if matches else
+                     [pattern] if os.path.exists(pattern) else [])
+    if not files:
+        raise ValueError('No pupil images match ' + ' '.join(patterns))
+    return files
+
+
+def outputPaths(files, out, fmt):
+    """
+    Returns the files the focal planes of files are written to, mirroring
+    their paths below their common folder under out. Raises a ValueError
+    if two of them would be written to the same file.
+    """
+    folders = [os.path.dirname(os.path.abspath(source)) for source in files]
+    root = os.path.commonpath(folders)
+    paths = []
+    for source in files:
+        relative = os.path.relpath(os.path.abspath(source), root)
+        paths.append(os.path.join(out, os.path.splitext(relative)[0] +
+                                  '_focal.' + fmt))
+    seen = {}
+    for source, path in zip(files, paths):
+        key = os.path.normcase(path)
+        if key in seen:
+            raise ValueError(seen[key] + ' and ' + source + ' would both be '
+                             'written to ' + path)
+        seen[key] = source
+    return paths
+
+
+def write(image, path, fmt):
+    """
+    Writes image to path in format fmt, under a temporary name first so a
+    half written file is never left behind.
+    """
+    temp = path + '.tmp.' + fmt
+    if fmt == 'npy':
+        np.save(temp, image)
+    elif fmt == 'txt':
+        np.savetxt(temp, image)
+    elif fmt == 'png':
+        # imported here so the other formats do not need matplotlib
+        from matplotlib import pyplot as ppl
+        ppl.imsave(temp, image, origin = 'lower', cmap = 'jet')
+    os.replace(temp, path)
+
+
+def processFile(task):
+    """
+    Pool task: computes and writes the focal plane of one file. Returns
+    (source, output path, seconds).
+    """
+    source, path, fmt, resolution, crop = task
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    write(focalImage(source, resolution, crop), path, fmt)
+    return source, path, time.perf_counter() - start
+
+
+def process(patterns, out, resolution = 12, fmt = 'npy', crop = None,
+            workers = None):
+    """
+    Writes the focal planes of all files matching patterns to the folder
+    out, workers at a time (by default one per CPU), printing each file
+    as it is done. Returns the list of files written.
+    """
+    if fmt not in formats:
+        raise ValueError('Unknown format ' + fmt + ', use one of ' +
+                         ', '.join(formats))
+    files = expand(patterns)
+    paths = outputPaths(files, out, fmt)
+    tasks = [(source, path, fmt, resolution, crop)
+             for source, path in zip(files, paths)]
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, len(files)))
+    written = []
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        results = (pool.imap_unordered(processFile, tasks) if pool else
+                   map(processFile, tasks))
+        for source, path, seconds in results:
+            print('%s -> %s (%.2f s)' % (source, path, seconds))
+            written.append(path)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return written
+
+
+def show(source, resolution = 12, crop = None):
+    """
+    Shows the pupil image source and its focal plane.
+    """
+    from matplotlib import pyplot as ppl
+    ppl.figure()
+    ppl.imshow(np.transpose(loadImage(source)), origin = 'lower',
+               cmap = 'gray')
+    ppl.figure()
+    ppl.imshow(focalImage(source, resolution, crop), origin = 'lower',
+               cmap = 'jet')
+    ppl.show()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Writes the focal plane '
+                                     'images of pupil images.')
+    parser.add_argument('files', nargs = '+',
+                        help = 'pupil images (.txt or .npy) or glob patterns')
+    parser.add_argument('--resolution', type = int, default = 12,
+                        help = 'pad the pupils to 2**resolution')
+    parser.add_argument('--crop', type = int, default = None,
+                        help = 'only compute and keep the central crop x '
+                        'crop pixels')
+    parser.add_argument('--format', default = 'npy', choices = formats)
+    parser.add_argument('--out', default = 'focal',
+                        help = 'folder the results are written to')
+    parser.add_argument('--workers', type = int, default = None,
+                        help = 'processes, by default one per CPU')
+    parser.add_argument('--show', action = 'store_true',
+                        help = 'plot each pupil and focal plane instead of '
+                        'writing files')
+    args = parser.parse_args()
+    try:
+        if args.show:
+            for source in expand(args.files):
+                show(source, args.resolution, args.crop)
+        else:
+            process(args.files, args.out, args.resolution, args.format,
+                    args.crop, args.workers)
+    except ValueError as ex:
+        parser.error(str(ex))
@@ -1,11 +1,19 @@
 #Brief Usage:
+#    To open the laser port (it stays open until l.close()):
+#        l = Laser(port, BaudRate, DataBits, StopBits)
 #    To enable the laser:
-#        l = Laser()
 #        l.enable()
 #    To disable the laser:
 #        l.disable()
 #    To get the status of the laser:
-#        status = l.status
+#        status = l.status()
+#        # returns the latest status read in the background at once, or
+#        # reads it if there is none yet; the status word as the laser
+#        # answers it (see laserStatus.py)
+#        status = l.status(fresh = True, timeout = 1)
+#        # reads the status now, waiting at most timeout seconds
+#    To read the status every interval seconds in the background:
+#        l.startMonitor(interval)
 #    To change the current of the laser:
 #        l.changeCurrent(current, channel)
 #        # Channel   |   Max Current
@@ -13,112 +21,203 @@
 #        # 2         |   63.89
 #        # 3         |   41.59
 #        # 4         |   67.39
+#    To change the currents of several channels at once:
+#        l.setCurrents({1: current1, 3: current3})
+#        # only the commands that change something are sent
 #    To calibrate the laser using automatic windows:
 #        center, secondary = l.calibrateLaser(image, mode, resolution)
 #    To calibrate the laser using manual windows:
 #        center, secondary = l.calibrateLaser(image, mode, resolution, cPoint,
 #                                             sPoint, cSize, sSize)
 #        # see the function itself for more specific information about calibration    
+#    To bring a channel to 90% of saturation in closed loop, with measure()
+#    returning the secondary peak over the saturation level:
+#        result = l.calibrateIntensity(measure, channel, target = 0.9)
+#        # result['converged'] is False if the target could not be reached,
+#        # only a converged model is saved for the next session
+#    To measure the intensity of a channel over its whole current range:
+#        table = l.characterize(measure, channel, ccdtemp = -40)
+#        # saved for the next sessions, table.currents, table.intensities
+#    To set a channel to an intensity (fraction of saturation) from the
+#    measured table:
+#        l.setIntensity(0.9, channel)
 
-import serial as s
-import time
-from ImageProcessing import fit_gauss_2D
+from laserSession import LaserSession
+from laserStatus import StatusMonitor
+from laserCommands import LaserScheduler, maxCurrent
+from laserModel import LaserModels, ResponseModel, closedLoop
+from laserTables import LaserTables, sweep
+from matrixFourier import FocalPlane
+from imageCache import loadImage
+from peakFitting import fitPeaks, lobeWindows
 import numpy as np
 from matplotlib import pyplot as plt
 
+# where the current to intensity models of the channels are kept
+modelFile = 'C:/Lab/FPWC/hardware/laserModels.json'
+# where the measured current to intensity tables are kept
+tableFile = 'C:/Lab/FPWC/hardware/laserTables.json'
+
 class Laser:
     
-    def __init__(self, port, BaudRate, DataBits, StopBits):
+    def __init__(self, port, BaudRate, DataBits, StopBits,
+                 modelFile = modelFile, tableFile = tableFile):
         """
-        Creats an instance of the Laser class. Creates a port attribute to
-        hold the connection to the laser.
+        Creats an instance of the Laser class. Creates a session attribute
+        that holds the connection to the laser open for the lifetime of
+        the object, and loads the channel models from modelFile and the
+        measured intensity tables from tableFile.
         """
-        self.port = s.Serial('port' = port, 'baudrate' = BaudRate, 
-                             'bytesize' = DataBits, 'stopbits' = StopBits)
+        self.session = LaserSession(port, BaudRate, DataBits, StopBits)
+        self.session.startReader()
+        self.port = self.session.port
+        self.monitor = StatusMonitor(self.session)
+        self.scheduler = LaserScheduler(self.session)
         self.current = None
         self.channel = None
-        self.status = None
+        self.systemStatus = None
+        self.models = LaserModels(modelFile)
+        self.tables = LaserTables(tableFile)
+    
+    def close(self):
+        """
+        Closes the connection to the laser.
+        """
+        self.monitor.stop()
+        self.session.close()
     
-    def enable(self, enableStatus):
+    def startMonitor(self, interval = 5.0):
+        """
+        Starts reading the status of the laser every interval seconds on a
+        background thread.
+        """
+        self.monitor.interval = interval
+        self.monitor.start()
+    
+    def enable(self):
         """
         Enables the laser.
         """
-        self.port.open()
-######################
-        ###### fprintf(F, '%s\r','system = 1')
-        self.port.write('system=1'.encode('utf-8'))
-        self.status = 'enabled'
+        self.session.command('system=1')
+        self.scheduler.invalidate()
+        self.systemStatus = 'enabled'
         print('Laser is now enabled')
-        self.port.close()
-        time.sleep(3)
         
-    def disbale(self):
+    def disable(self):
         """
         Disables the laser.
         """
-        self.port.open()
-###############
-        #### similar questions as above
-        self.port.write('enable=0'.encode('utf-8'))
-        self.port.write('system=0'.encode('utf-8'))
-        self.status = 'disabled'
+        self.session.command('enable=0')
+        self.session.command('system=0')
+        self.scheduler.invalidate()
+        self.systemStatus = 'disabled'
         print('Laser is now disabled')
-        self.port.close()
-        time.sleep(3)
+    
+    # kept for scripts written against the old misspelled name
+    disbale = disable
         
-    def status(self):
-        """
-        Gets the status of the laser and returns it.
-        """
-        self.port.open()
-        self.port.write('statword?'.encode('utf-8'))
-        time.sleep(2)
-        while self.port.in_waiting > 0:
-            statword += self.port.read(1)
-        time.sleep(1)
-        self.status = statword
-        self.port.close()
-        return statword
+    def status(self, fresh = False, timeout = 2.0):
+        """
+        Gets the status of the laser and returns it. Unless fresh is True,
+        the latest status read in the background is returned without
+        waiting. Otherwise the status is read now, raising a TimeoutError
+        if the laser does not answer within timeout seconds.
+        """
+        if not fresh:
+            status, age = self.monitor.latest()
+            if status is not None:
+                return status
+        return self.monitor.fresh(timeout)
     
     def changeCurrent(self, current, channel):
         """
         Chagces the current (in mA) of a specific channel of the laser
         """
-        self.port.open()
-        
-        if channel == 1:
-            max_current = 68.09
-        elif channel == 2:
-            max_current = 63.89
-        elif channel == 3:
-            max_current = 41.59
-        elif channel == 4:
-            max_current = 67.39
-        else:
-            print('No Way! channel shall be 1, 2, 3, or 4 only!')
-            max_current = 0
-            
-        if power > max_current:
-            print('No Way! power must be less than ' + max_current + ' mA only.')
-        elif power == 0:
-            self.port.write(('channel=' + channel).encode('utf-8'))
-            time.sleep(2)
-            self.port.write('enable=0'.encode('utf-8'))
-            time.sleep(1)
-        else:
-            self.port.write(('channel=' + channel).encode('utf-8'))
-            self.channel = channel
-            time.sleep(2)
-            self.port.write(('enable=' + channel).encode('utf-8'))
-            self.status = 'enabled'
-            time.sleep(2)
-            self.port.write(('current=' + current).encode('utf-8'))
+        try:
+            self.setCurrents({channel: current})
+        except ValueError as ex:
+            print(ex)
+            return
+        self.channel = channel
+        if current != 0:
             self.current = current
-            time.sleep(1)
-        
-        self.port.close()
+    
+    def setCurrents(self, currents):
+        """
+        Changes the currents (in mA) of several channels, given as a
+        dictionary of channel: current. A current of 0 turns the channel
+        off. Every current is checked against the channel's maximum before
+        anything is sent, and only the commands that change the state of
+        the laser are sent. Returns the commands sent.
+        """
+        return self.scheduler.setpoints(currents)
+    
+    def calibrateIntensity(self, measure, channel = None, target = 0.9,
+                           tolerance = 0.01, maxSteps = 8):
+        """
+        Changes the current of channel (by default the last one changed)
+        until measure(), the peak intensity as a fraction of saturation,
+        is within tolerance of target. Starts from the stored model of the
+        channel, its measured table or the current current, in that
+        order, and refits the model after every measurement. If it
+        converged the model is saved for the next session. Returns the
+        result of laserModel.closedLoop, result['converged'] telling
+        whether the target was reached.
+        """
+        if channel is None:
+            channel = self.channel
+        model = self.models.get(channel)
+        table = self.tables.get(channel)
+        start = None
+        if model is None:
+            start = self.current
+            if table is not None:
+                start = table.current(min(target,
+                                          table.monotoneIntensities[-1]))
+        setCurrent = lambda current: self.setCurrents({channel: current})
+        result = closedLoop(setCurrent, measure, model, target = target,
+                            tolerance = tolerance, maxSteps = maxSteps,
+                            start = start, maxCurrent = maxCurrent[channel])
+        self.channel = channel
+        self.current = result['current']
+        if result['converged'] and result['model'] is not None:
+            self.models.put(channel, result['model'])
+        return result
+    
+    def characterize(self, measure, channel, currents = None,
+                     ccdtemp = None, points = 20):
+        """
+        Steps channel through currents (by default points currents from 0
+        to its maximum) and measures the peak intensity at each with
+        measure(), a fraction of saturation, until it saturates. The
+        table is saved with the time and ccdtemp, the CCD temperature,
+        and returned. The channel is left at the last current.
+        """
+        if currents is None:
+            currents = np.linspace(0, maxCurrent[channel], points)
+        setCurrent = lambda current: self.setCurrents({channel: current})
+        table = sweep(setCurrent, measure, currents, ccdtemp)
+        self.tables.put(channel, table)
+        self.channel = channel
+        return table
+    
+    def setIntensity(self, intensity, channel = None):
+        """
+        Sets channel (by default the last one changed) to the current
+        giving intensity, a fraction of saturation, according to its
+        measured table. Raises a ValueError if the channel has no table
+        or the intensity is outside it.
+        """
+        if channel is None:
+            channel = self.channel
+        table = self.tables.get(channel)
+        if table is None:
+            raise ValueError('Channel ' + str(channel) + ' has not been '
+                             'characterized')
+        self.changeCurrent(table.current(intensity), channel)
+        return self.current
         
-    def calibrateLaser(image, mode, resolution, os, *args):
+    def calibrateLaser(self, image, mode, resolution, os, *args):
         """
         Calibrates the laser so that the peak of the secondary pattern is
         at 90% saturation. It then returns a tuple of peak intensity, 
@@ -127,62 +226,70 @@ class Laser:
         over saturated. If mode = 'man', the program takes four positional
         arguments: the central peak point, the secondary peak point, the 
         side length of the central peak square, and the side length of the 
-        secondary peak sqaure. Resoultion should be 11 or 12, with 12 being
-        better resolution. 
+        secondary peak sqaure. The image is padded to 2**resolution, larger
+        is more precise and slower; 11 or 12 is usual. A current must have
+        been set with changeCurrent first, the one the image was taken at;
+        the new current comes from the channel's model corrected by the
+        image. Raises a ValueError if not, or if mode is unknown.
         """
+        if self.current is None or self.channel is None:
+            raise ValueError('Set the current with changeCurrent before '
+                             'calibrating')
         # the following code is used for loading the simulation image
         # Note: should be removed in the final code, along with the os
-        # parameter
-        if image == 0:
+        # parameter. image can also be an array or the path of a file,
+        # text files are only parsed the first time (see imageCache.py)
+        if np.isscalar(image) and image == 0:
             if os == 'windows':
-               image = np.loadtxt(
-                       '//mac/Home/Desktop/ripple3_256x256_ideal_undersized.txt')
+               image = '//mac/Home/Desktop/ripple3_256x256_ideal_undersized.txt'
             elif os == 'mac':
-                image = np.loadtxt(
-                        '/Users/matthewgrossman/Desktop/ripple3_256x256_...ideal_undersized.txt')
+                image = '/Users/matthewgrossman/Desktop/ripple3_256x256_ideal_undersized.txt'
+            else:
+                raise ValueError('No simulation image for os ' + str(os))
         # transposes the image so it is oriented correctly
-        image = np.transpose(image)
-        # places the original image at the center of a solid black image 
-        # with dimensions N x N to increase the resolution of the transform.
+        image = np.transpose(loadImage(image))
+        # the fourier transform of the image placed at the center of a
+        # solid black N x N image, to increase the resolution of the
+        # transform. Only the windows cropped out of it are computed.
         N = 2**resolution
-        largeImage = np.zeros((N, N))
-        x = np.ma.size(image, 0)
-        y = np.ma.size(image, 1)
-        largeImage[int((N - x) / 2) : int((N + x) / 2),
-                   int((N - y) / 2) : int((N + y) / 2)] = image
-        # performs the fourier transform of the larger image.
-        Fourier = np.fft.fftshift(np.fft.fft2(np.fft.fftshift(largeImage)))
-        Fourier = abs(Fourier)/np.max(np.max(abs(Fourier)))
+        Fourier = FocalPlane(image, N)
         # determines which mode should be used to find peak intensities
         if mode == 'auto':
-            center, secondary = gaussAuto(Fourier, N)
+            center, secondary = self.gaussAuto(Fourier, N)
         elif mode == 'man':
-            center, secondary = gaussManual(Fourier, args[0], args[1],
-                                            args[2], args[3])
+            center, secondary = self.gaussManual(Fourier, args[0], args[1],
+                                                 args[2], args[3])
         else:
-            print('Unknown calibration command')
-        # determines the proper amount to increase the laser current from
-        # the guassians and then increases the laser's current.
-        scale = .9 / secondary[0]
-#######
-        ######## need to get current level of laser and then multiply by scale
-        newCurrent = scale * self.current
+            raise ValueError('Unknown calibration command ' + str(mode))
+        # determines the current giving 90% from the stored model of the
+        # channel corrected by this measurement (see laserModel.py), which
+        # unlike scaling the current accounts for the threshold, and then
+        # changes the laser's current. The one measurement is not saved.
+        model = self.models.get(self.channel)
+        if model is None:
+            model = ResponseModel(secondary[0] / self.current)
+        else:
+            model = ResponseModel(model.slope, model.threshold)
+        model.fit([(self.current, secondary[0])])
+        # limited to what the channel takes, so the current is always set
+        newCurrent = min(model.current(.9), maxCurrent[self.channel])
         self.changeCurrent(newCurrent, self.channel)
-#########
-        ######### ask Christian about exact math here and what data he needs
         # returns two tuples representing the new peak intensities and
-        # their locations. 
-        newCenterPeak = scale * center[0]
-        newSecondaryPeak = scale * secondary[0]
-        reutrn (newCenterPeak, center[1], center[2]), (newSecondaryPeak, 
+        # their locations, the center scaling like the secondary peak.
+        newSecondaryPeak = model.intensity(newCurrent)
+        newCenterPeak = center[0] * newSecondaryPeak / secondary[0]
+        return (newCenterPeak, center[1], center[2]), (newSecondaryPeak, 
                secondary[1], secondary[2])
     
-    def gaussManual(Fourier, cPoint, sPoint, cSize, sSize):
+    def gaussManual(self, Fourier, cPoint, sPoint, cSize, sSize,
+                    refine = False):
         """
         Locates the peak intensity and its location for both the center
         and secondary patterns given a point near each of the pattern's 
         centers and a rough area to look in. Returns this info as a three 
-        value tuple for the center and for the secondary pattern.
+        value tuple for the center and for the secondary pattern. The
+        peaks are found in closed form, if refine is True they are then
+        fitted by least squares.
         """
         # crops the Fourier image to get images of just the two patterns
         # Note that the y-coordinate is cropped first
@@ -201,20 +308,20 @@ class Laser:
 #            ix2 = int(isecondarycoordinates[1] + sPoint[0] - sSize/2)
 #            iy2 = int(isecondarycoordinates[0] + sPoint[1] - sSize/2)
         # Gets the paramenters of the gaussian for both patterns
-        centerParams = fit_gauss_2D(centerPat)
-        secondaryParams = fit_gauss_2D(secondaryPat)
+        centerParams, secondaryParams = fitPeaks([centerPat, secondaryPat],
+                                                 refine)
         centerheight = centerParams[0]
         centerX = centerParams[1]
         centerY = centerParams[2]
         secondaryHeight = secondaryParams[0]
         secondaryX = secondaryParams[1]
         secondaryY = secondaryParams[2]
-        # converts the coordinates in the cropped image into those of the 
-        # original one. 
-        x1 = int(centerX + cPoint[0] - cSize/2)
-        y1 = int(centerY + cPoint[1] - cSize/2)
-        x2 = int(secondaryX + sPoint[0] - sSize/2)
-        y2 = int(secondaryY + sPoint[1] - sSize/2)
+        # converts the sub-pixel coordinates in the cropped image into
+        # those of the original one. 
+        x1 = centerX + int(cPoint[0] - cSize/2)
+        y1 = centerY + int(cPoint[1] - cSize/2)
+        x2 = secondaryX + int(sPoint[0] - sSize/2)
+        y2 = secondaryY + int(sPoint[1] - sSize/2)
         print ((centerheight, x1, y1), (secondaryHeight, x2,
                y2))
 #            print(icenterheight, (ix1, iy1), isecondaryheight,
@@ -222,18 +329,14 @@ class Laser:
         return (centerheight, x1, y1), (secondaryHeight, x2,
                y2)
         
-    def gaussAuto(Fourier, n):
-        """
-        Calls GaussManual using arguments that usually closely identify 
-        the peak intensities. The choice in arguments is based on the
-        resolution of the image. Returns the same values as GaussManual
-        """
-        # Note: this function could potentially be expanded to other 
-        # resolutions by multiplying the parameters by a power of 2
-        if n == 11:
-            center, secondary = GaussManual(Fourier, (1025, 1025), 
-                                            (950, 1025), 85, 34)
-        elif n == 12:
-            center, secondary = GaussManual(Fourier, (2050, 2050),
-                                            (1900, 2050), 170, 68)
+    def gaussAuto(self, Fourier, N, refine = False):
+        """
+        Calls GaussManual on windows around the center and secondary
+        patterns found by a coarse search of the N x N Fourier image.
+        The window sizes scale with N, so any resolution works. Returns
+        the same values as GaussManual
+        """
+        cPoint, sPoint, cSize, sSize = lobeWindows(Fourier, N)
+        center, secondary = self.gaussManual(Fourier, cPoint, sPoint,
+                                             cSize, sSize, refine)
         return center, secondary
\ No newline at end of file
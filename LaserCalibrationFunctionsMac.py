@@ -1,14 +1,15 @@
-from ImageProcessing import twoD_Gaussian
-from ImageProcessing import fit_gauss_2D
+from peakFitting import fitPeaks, lobeWindows
 import numpy as np
 from matplotlib import pyplot as plt
-def GaussManual(Fourier, cPoint, sPoint, cSize, sSize):
+from matrixFourier import FocalPlane
+from imageCache import loadImage
+def GaussManual(Fourier, cPoint, sPoint, cSize, sSize, refine = False):
     centerPat = Fourier[int(cPoint[1] - cSize/2) : int(cPoint[1] + cSize/2),
                         int(cPoint[0] - cSize/2) : int(cPoint[0] + cSize/2)]
     secondaryPat = Fourier[int(sPoint[1] - sSize/2) : int(sPoint[1] + sSize/2),
                            int(sPoint[0] - sSize/2) : int(sPoint[0] + sSize/2)]
-    centerParams = fit_gauss_2D(centerPat)
-    secondaryParams = fit_gauss_2D(secondaryPat)
+    centerParams, secondaryParams = fitPeaks([centerPat, secondaryPat],
+                                             refine)
     centerheight = centerParams[0]
     centerX = centerParams[1]
     centerY = centerParams[2]
@@ -21,20 +22,18 @@ def GaussManual(Fourier, cPoint, sPoint, cSize, sSize):
            secondaryY)
                    
 def CalibrateLaser(image, mode, resolution, *args):
-    image = np.loadtxt('/Users/matthewgrossman/Desktop/ripple3_256x256_ideal_undersized.txt')
-    image = np.transpose(image)
+    if np.isscalar(image) and image == 0:
+        image = '/Users/matthewgrossman/Desktop/ripple3_256x256_ideal_undersized.txt'
+    image = np.transpose(loadImage(image))
     N = 2**resolution
-    largeImage = np.zeros((N, N))
-    x = np.ma.size(image, 0)
-    y = np.ma.size(image, 1)
-    largeImage[int((N - x) / 2) : int((N + x) / 2),
-               int((N - y) / 2) : int((N + y) / 2)] = image
-    Fourier = np.fft.fftshift(np.fft.fft2(np.fft.fftshift(largeImage)))
-    Fourier = abs(Fourier)/np.max(np.max(abs(Fourier)))
+    # only the windows GaussManual crops out are transformed
+    Fourier = FocalPlane(image, N)
     if mode == 'auto':
-        pass
-#        CalibrateLaserAuto(Fourier)
+        cPoint, sPoint, cSize, sSize = lobeWindows(Fourier, N)
+        center, secondary = GaussManual(Fourier, cPoint, sPoint, cSize, sSize)
     elif mode == 'man':
-        GuassManual(Fourier, args[0], args[1], args[2], args[3])
+        center, secondary = GaussManual(Fourier, args[0], args[1], args[2],
+                                        args[3])
     else:
-        print('Unknown calibration command')
\ No newline at end of file
+        raise ValueError('Unknown calibration command ' + str(mode))
+    return center, secondary
\ No newline at end of file
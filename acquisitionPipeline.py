@@ -0,0 +1,158 @@
+# acquisitionPipeline - overlaps camera readout with frame processing
+#
+# The calling thread takes exposures back to back and puts each frame on a
+# bounded queue, while worker threads take frames off the queue, process
+# them, and fold the results into the stack. When the workers fall behind
+# the queue fills up and the calling thread blocks, so at most depth frames
+# are ever waiting. The time per frame is then set by the exposure and
+# readout instead of exposure, readout and processing. acquire only ever
+# runs on the calling thread, because the camera is a COM object that
+# belongs to the thread that created it; only process and accumulate run
+# on the workers and must not touch the camera.
+#
+# Frames handed out by Camera.exposure live in its FrameRing and are reused
+# after ringDepth exposures, so the ring must be deeper than the number of
+# frames the pipeline can hold at once (see AcquisitionPipeline.inFlight).
+#
+#Brief Usage:
+#    Average numIm exposures while the next one is being taken:
+#        stack = FrameStacker()
+#        pipe = AcquisitionPipeline(lambda: camera.exposure(expTime),
+#                                   accumulate = stack.add)
+#        stats = pipe.run(numIm)
+#    Dark subtract each frame on two worker threads before stacking:
+#        pipe = AcquisitionPipeline(acquire, lambda f: f - darkFrame,
+#                                   stack.add, workers = 2)
+#        # stats['wall'] is the total time and stats['perFrame'] the time
+#        # per frame in seconds
+
+import queue
+import threading
+import time
+
+
+class AcquisitionPipeline:
+    """
+    Runs acquisition on the calling thread and processing on worker
+    threads, connected by a bounded queue.
+    """
+
+    def __init__(self, acquire, process = None, accumulate = None,
+                 workers = 1, depth = 2):
+        """
+        acquire() returns the next frame, called on the thread that calls
+        run, process(frame) turns it into a result on a worker thread and
+        accumulate(result) folds the result in. accumulate is only ever
+        called by one thread at a time. depth is the number of frames that
+        can wait for a worker.
+        """
+        if workers < 1:
+            raise ValueError('Pipeline needs at least one worker')
+        if depth < 1:
+            raise ValueError('Queue depth must be at least 1')
+        self.acquire = acquire
+        self.process = process
+        self.accumulate = accumulate
+        self.workers = workers
+        self.depth = depth
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.errors = []
+
+    def inFlight(self):
+        """
+        Returns the most frames the pipeline can hold at once: the ones
+        queued, the ones being processed, and the one being acquired.
+        """
+        return self.depth + self.workers + 1
+
+    def run(self, numIm):
+        """
+        Acquires numIm frames on this thread while the workers process
+        them, and returns a dictionary of the frame count, total wall time
+        and wall time per frame. The first error raised by any thread
+        stops the pipeline and is re-raised.
+        """
+        frames = queue.Queue(self.depth)
+        self.stop.clear()
+        self.errors = []
+        start = time.perf_counter()
+        workers = [threading.Thread(target = self.consume, args = (frames,))
+                   for i in range(self.workers)]
+        for worker in workers:
+            worker.start()
+        # the camera stays on the thread that created it
+        self.produce(frames, numIm)
+        for worker in workers:
+            worker.join()
+        wall = time.perf_counter() - start
+        if self.errors:
+            raise self.errors[0]
+        return {'frames': numIm, 'wall': wall,
+                'perFrame': wall / numIm if numIm else 0.0}
+
+    def produce(self, frames, numIm):
+        """
+        Calling thread: acquires numIm frames and queues them, then queues
+        one end marker per worker.
+        """
+        try:
+            for i in range(numIm):
+                if self.stop.is_set():
+                    break
+                frame = self.acquire()
+                # blocks while the workers are behind
+                while not self.stop.is_set():
+                    try:
+                        frames.put(frame, timeout = 0.1)
+                        break
+                    except queue.Full:
+                        pass
+        except Exception as ex:
+            self.fail(ex)
+        finally:
+            for i in range(self.workers):
+                self.putEnd(frames)
+
+    def consume(self, frames):
+        """
+        Worker thread: processes and accumulates frames until the end
+        marker arrives.
+        """
+        while True:
+            frame = frames.get()
+            if frame is None:
+                return
+            if self.stop.is_set():
+                continue
+            try:
+                result = frame if self.process is None else self.process(frame)
+                if self.accumulate is not None:
+                    with self.lock:
+                        self.accumulate(result)
+            except Exception as ex:
+                self.fail(ex)
+
+    def putEnd(self, frames):
+        """
+        Queues an end marker, dropping a waiting frame if the pipeline has
+        been stopped and the queue is full.
+        """
+        while True:
+            try:
+                frames.put(None, timeout = 0.1)
+                return
+            except queue.Full:
+                if self.stop.is_set():
+                    try:
+                        frames.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def fail(self, ex):
+        """
+        Records an error and tells every thread to stop.
+        """
+        with self.lock:
+            self.errors.append(ex)
+        self.stop.set()
@@ -0,0 +1,118 @@
+# autoExposure - picks the exposure time of the next lab image
+#
+# The peak of the dark subtracted image is assumed to grow linearly with
+# exposure time, so one image gives the peak count rate, and the next
+# exposure time is the one that puts the peak in the middle of a target
+# band below saturation. The exposure time is left alone while the peak
+# stays inside the band, and it never changes by more than maxStep in one
+# go or leaves [minExp, maxExp]. A frame that saturates only shows that the
+# rate is at least saturation / expTime, so the exposure time is cut by
+# more than the band would ask for.
+#
+# saturationLevel is the level, in raw counts, above which a QSI frame
+# counts as saturated. Frames are 16 bit, and the response stops being
+# linear before 65535, so everything that needs a saturation level (auto
+# exposure, the early abort of stacks, HDR merging) uses this one value.
+#
+#Brief Usage:
+#    Keep the peak of the dark hole between 50% and 80% of saturation:
+#        auto = AutoExposure(saturationLevel, mask = darkHoleMask)
+#    After each image:
+#        camera.exposure = auto.update(img, camera.exposure)
+#    After a frame saturated:
+#        camera.exposure = auto.saturated(camera.exposure)
+#    Stop a stack as soon as a frame saturates:
+#        checkSaturation(frame, saturationLevel)
+#        # raises SaturationError
+
+import numpy as np
+
+# raw counts above which a camera frame counts as saturated
+saturationLevel = 60000
+
+
+class SaturationError(ValueError):
+    """
+    Raised when a camera frame is saturated.
+    """
+    pass
+
+
+def checkSaturation(frame, saturation):
+    """
+    Raises a SaturationError if any pixel of frame is above saturation.
+    """
+    peak = np.max(frame)
+    if peak > saturation:
+        raise SaturationError('The camera image is saturated!! STOP!! '
+                              '(peak ' + str(peak) + ')')
+
+
+class AutoExposure:
+    """
+    Predicts the exposure time that keeps the image peak inside a target
+    band from a linear counts per second model.
+    """
+
+    def __init__(self, saturation, low = 0.5, high = 0.8, minExp = 1e-3,
+                 maxExp = 60.0, mask = None, maxStep = 10.0, backoff = 4.0):
+        """
+        saturation is the saturation level in counts and low and high are
+        the edges of the target band as fractions of it. mask selects the
+        pixels the peak is taken over (the dark hole), or None for the
+        whole image. backoff is how much more than the band asks for the
+        exposure time is cut after a saturated frame.
+        """
+        if not 0 < low < high < 1:
+            raise ValueError('Target band must satisfy 0 < low < high < 1')
+        if not 0 < minExp <= maxExp:
+            raise ValueError('Exposure limits must satisfy 0 < min <= max')
+        self.saturation = saturation
+        self.low = low
+        self.high = high
+        self.minExp = minExp
+        self.maxExp = maxExp
+        self.mask = mask
+        self.maxStep = maxStep
+        self.backoff = backoff
+        self.rate = None
+
+    def peak(self, img):
+        """
+        Returns the peak of img over the mask.
+        """
+        if self.mask is None:
+            return np.max(img)
+        return np.max(img[self.mask])
+
+    def clamp(self, expTime, newTime):
+        """
+        Limits newTime to maxStep times expTime either way and to the
+        exposure limits.
+        """
+        newTime = min(max(newTime, expTime / self.maxStep),
+                      expTime * self.maxStep)
+        return min(max(newTime, self.minExp), self.maxExp)
+
+    def update(self, img, expTime):
+        """
+        Updates the count rate model from a dark subtracted image taken
+        with exposure time expTime and returns the next exposure time.
+        """
+        peak = self.peak(img)
+        if peak <= 0:
+            # nothing measurable, open up as far as allowed
+            return self.clamp(expTime, expTime * self.maxStep)
+        self.rate = peak / expTime
+        if self.low * self.saturation <= peak <= self.high * self.saturation:
+            return expTime
+        target = 0.5 * (self.low + self.high) * self.saturation
+        return self.clamp(expTime, target / self.rate)
+
+    def saturated(self, expTime):
+        """
+        Returns the next exposure time after a frame of exposure time
+        expTime saturated.
+        """
+        newTime = expTime * 0.5 * (self.low + self.high) / self.backoff
+        return self.clamp(expTime, newTime)
@@ -0,0 +1,146 @@
+# batchCalibration - finds the calibration peaks of many pupil images on a
+#   process pool
+#
+# Does what Laser.calibrateLaser does to measure the peaks (transpose, pad
+# to 2**resolution, fit the center and secondary lobes) for a whole stack
+# of pupil images, or a stack per laser channel, without touching the
+# laser. The stack is copied once into shared memory and the worker
+# processes read their images from there, so only image indices and
+# result rows are pickled. Each image gives one row of a structured array
+# with the fields of peakDtype. The windows are found automatically like
+# gaussAuto, or given like for gaussManual.
+#
+# The pool uses processes, not threads, so on Windows it must be started
+# from under if __name__ == '__main__' when run as a script.
+#
+#Brief Usage:
+#    Peaks of a recorded stack of pupil images (k x 256 x 256):
+#        peaks = calibrateStack(stack, resolution = 11)
+#        peaks['secondaryHeight']
+#    With fixed windows, least squares refinement and 4 processes:
+#        peaks = calibrateStack(stack, 11, ((1025, 1025), (950, 1025),
+#                               85, 34), refine = True, workers = 4)
+#    One stack or image per laser channel:
+#        tables = calibrateChannels({1: stack1, 2: image2}, 11)
+#        tables[1]['centerX']
+
+import os
+import numpy as np
+from multiprocessing import Pool, shared_memory
+from matrixFourier import FocalPlane
+from peakFitting import fitLobes, lobeWindows
+
+# one row per pupil image
+peakDtype = np.dtype([('image', np.int64), ('channel', np.int64),
+                      ('centerHeight', np.float64),
+                      ('centerX', np.float64), ('centerY', np.float64),
+                      ('secondaryHeight', np.float64),
+                      ('secondaryX', np.float64),
+                      ('secondaryY', np.float64)])
+
+# the stack a worker process reads from, set by attach
+shared = {}
+
+
+def attach(name, shape, dtype):
+    """
+    Pool initializer: maps the shared memory block name as the stack.
+    """
+    block = shared_memory.SharedMemory(name = name)
+    shared['block'] = block
+    shared['stack'] = np.ndarray(shape, dtype, buffer = block.buf)
+
+
+def measure(image, N, windows = None, refine = False):
+    """
+    Returns the (2 x 5) center and secondary peak parameters of one pupil
+    image padded to N x N, with windows (cPoint, sPoint, cSize, sSize) or
+    found automatically.
+    """
+    Fourier = FocalPlane(np.transpose(image), N)
+    if windows is None:
+        windows = lobeWindows(Fourier, N)
+    return fitLobes(Fourier, *windows, refine = refine)
+
+
+def measureShared(task):
+    """
+    Worker task: measures image index of the shared stack and returns
+    (index, parameters).
+    """
+    index, N, windows, refine = task
+    return index, measure(shared['stack'][index], N, windows, refine)
+
+
+def calibrateStack(stack, resolution = 11, windows = None, refine = False,
+                   workers = None, channels = None):
+    """
+    Measures the peaks of every image of stack (k x height x width) padded
+    to 2**resolution and returns a structured array of peakDtype rows.
+    windows is None to find the lobes of each image, or (cPoint, sPoint,
+    cSize, sSize) like for gaussManual. workers is the number of
+    processes, by default one per CPU; 1 runs in this process. channels
+    gives the channel of each image for the channel field.
+    """
+    stack = np.ascontiguousarray(stack, np.float64)
+    if stack.ndim == 2:
+        stack = stack[np.newaxis]
+    N = 2**resolution
+    k = len(stack)
+    peaks = np.zeros(k, peakDtype)
+    peaks['image'] = np.arange(k)
+    if channels is not None:
+        peaks['channel'] = channels
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, k))
+    if workers == 1:
+        results = ((i, measure(stack[i], N, windows, refine))
+                   for i in range(k))
+        fill(peaks, results)
+        return peaks
+    block = shared_memory.SharedMemory(create = True, size = stack.nbytes)
+    try:
+        np.ndarray(stack.shape, stack.dtype, buffer = block.buf)[:] = stack
+        tasks = [(i, N, windows, refine) for i in range(k)]
+        with Pool(workers, attach, (block.name, stack.shape,
+                                    stack.dtype.str)) as pool:
+            fill(peaks, pool.imap_unordered(measureShared, tasks))
+    finally:
+        block.close()
+        block.unlink()
+    return peaks
+
+
+def fill(peaks, results):
+    """
+    Copies (index, parameters) results into the rows of peaks.
+    """
+    for index, params in results:
+        row = peaks[index]
+        row['centerHeight'], row['centerX'], row['centerY'] = params[0, :3]
+        (row['secondaryHeight'], row['secondaryX'],
+         row['secondaryY']) = params[1, :3]
+
+
+def calibrateChannels(images, resolution = 11, windows = None,
+                      refine = False, workers = None):
+    """
+    Measures the peaks of the images of several laser channels, a
+    dictionary of channel: image or stack, in one pool. Returns a
+    dictionary of channel: structured array of peakDtype rows, numbered
+    within the channel.
+    """
+    stacks = dict((channel, np.asarray(stack, np.float64).reshape(
+                       (-1,) + np.shape(stack)[-2:]))
+                  for channel, stack in images.items())
+    channels = np.concatenate([np.full(len(stack), channel)
+                               for channel, stack in stacks.items()])
+    peaks = calibrateStack(np.concatenate(list(stacks.values())),
+                           resolution, windows, refine, workers, channels)
+    tables = {}
+    for channel in stacks:
+        table = peaks[peaks['channel'] == channel]
+        table['image'] = np.arange(len(table))
+        tables[channel] = table
+    return tables
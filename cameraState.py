@@ -0,0 +1,134 @@
+# cameraState - mirrors camera settings to skip redundant COM writes
+#
+# Every read or write of a property of the QSI driver is a COM round trip.
+# A CameraState keeps a copy of each setting it has read or written, and
+# only sends a write when the new value differs from the copy. The driver
+# may clamp or round some settings (the set CCD temperature, the region and
+# the binning), so those are read back after every write and the copy holds
+# what the camera actually uses, not what was asked for. The last value
+# asked for is remembered too, so asking again for a clamped value sends
+# nothing either. Settings
+# that change together (start position, image size and binning) are
+# validated as a whole and written in the order the driver needs. The
+# copies are only trusted while the connection lasts, so invalidate() must
+# be called whenever the camera is reconnected.
+#
+#Brief Usage:
+#    Mirror the settings of a camera handle:
+#        state = CameraState(handle)
+#    Read and write a setting:
+#        fan = state.get('FanMode')
+#        state.set('ManualShutterMode', True)
+#        # returns True if a write was sent to the camera
+#        state.set('SetCCDTemperature', -60)
+#        ccdtemp = state.get('SetCCDTemperature')
+#        # the temperature the driver accepted, which may differ
+#    Change the region and binning in one step:
+#        state.exposureproperties((0, 0), (500, 500), (2, 2))
+#    Several settings at once:
+#        state.apply({'ReadoutSpeed': 0, 'ShutterPriority': 1})
+#    Forget the copies after a reconnect:
+#        state.invalidate()
+
+# settings the driver may change on writing, read back after every write
+readBack = ('SetCCDTemperature', 'BinX', 'BinY', 'StartX', 'StartY', 'NumX',
+            'NumY')
+
+
+class CameraState:
+    """
+    A write-through cache of the settings of a camera handle.
+    """
+
+    def __init__(self, handle):
+        """
+        Creates an empty cache for handle.
+        """
+        self.handle = handle
+        self.values = {}
+        self.requested = {}
+        self.writes = 0
+        self.skipped = 0
+
+    def invalidate(self, handle = None):
+        """
+        Forgets every cached value, and switches to handle if it is given.
+        """
+        if handle is not None:
+            self.handle = handle
+        self.values = {}
+        self.requested = {}
+
+    def get(self, name):
+        """
+        Returns the value of setting name, reading it from the camera only
+        the first time.
+        """
+        if name not in self.values:
+            self.values[name] = getattr(self.handle, name)
+        return self.values[name]
+
+    def set(self, name, value):
+        """
+        Writes value to setting name unless the cached value already
+        equals it, or value is what the last write asked for. Settings in
+        readBack are read from the camera after the write, so the cache
+        holds the value the driver kept. Returns True if a write was sent.
+        """
+        if name in self.values and (self.values[name] == value or
+                                    self.requested.get(name) == value):
+            self.skipped += 1
+            return False
+        setattr(self.handle, name, value)
+        self.requested[name] = value
+        if name in readBack:
+            value = getattr(self.handle, name)
+        self.values[name] = value
+        self.writes += 1
+        return True
+
+    def apply(self, settings):
+        """
+        Writes several settings in the order given, skipping unchanged
+        ones. settings is a dictionary or a sequence of (name, value)
+        pairs. If a write fails the cached values of the settings are
+        dropped so they are read back from the camera next time.
+        """
+        if hasattr(settings, 'items'):
+            settings = list(settings.items())
+        try:
+            for name, value in settings:
+                self.set(name, value)
+        except Exception:
+            for name, value in settings:
+                self.values.pop(name, None)
+                self.requested.pop(name, None)
+            raise
+
+    def exposureproperties(self, startPos, imgSize, binPix):
+        """
+        Checks that the region fits on the sensor at the given binning and
+        writes it in one step, binning first since the driver measures the
+        start position and size in binned pixels.
+        """
+        if len(startPos) != 2:
+            raise ValueError('Wrong dimension of start position')
+        if len(imgSize) != 2:
+            raise ValueError('Wrong dimension of picture size')
+        if len(binPix) != 2:
+            raise ValueError('Wrong dimension of binned pixels')
+        if binPix[0] < 1 or binPix[1] < 1:
+            raise ValueError('Binned pixels must be at least 1')
+        if binPix[0] > self.get('MaxBinX') or binPix[1] > self.get('MaxBinY'):
+            raise ValueError('Binned pixels larger than the camera allows')
+        if imgSize[0] < 1 or imgSize[1] < 1:
+            raise ValueError('Picture size must be at least 1')
+        if startPos[0] < 0 or startPos[1] < 0:
+            raise ValueError('Start position must not be negative')
+        if (startPos[0] + imgSize[0] > self.get('CameraXSize') // binPix[0] or
+                startPos[1] + imgSize[1] >
+                self.get('CameraYSize') // binPix[1]):
+            raise ValueError('Picture does not fit on the sensor')
+        self.apply((('BinX', binPix[0]), ('BinY', binPix[1]),
+                    ('StartX', startPos[0]), ('StartY', startPos[1]),
+                    ('NumX', imgSize[0]), ('NumY', imgSize[1])))
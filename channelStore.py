@@ -0,0 +1,64 @@
+# channelStore - one object per laser channel, kept in a json file
+#
+# ChannelStore reads and writes a json file holding one entry per laser
+# channel, keyed by the channel number. The entries are objects with a
+# toDict method, read back with the fromDict function given to the store.
+# The file is written under a temporary name and then swapped in, so an
+# interrupted write never leaves half a file. laserModel.LaserModels and
+# laserTables.LaserTables are stores of response models and of measured
+# intensity tables.
+#
+#Brief Usage:
+#    Open a store of ResponseModels, store one and read it back:
+#        store = ChannelStore('C:/Lab/FPWC/hardware/laserModels.json',
+#                             ResponseModel.fromDict)
+#        store.put(2, model)
+#        model = store.get(2)
+#        # None if channel 2 has nothing stored
+
+import json
+import os
+
+
+class ChannelStore:
+    """
+    Per channel objects stored in a json file.
+    """
+
+    def __init__(self, path, fromDict):
+        """
+        Reads the objects stored in path, if it exists, with fromDict.
+        """
+        self.path = path
+        self.items = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for channel, values in json.load(f).items():
+                    self.items[int(channel)] = fromDict(values)
+
+    def get(self, channel):
+        """
+        Returns the stored object of channel, or None.
+        """
+        return self.items.get(channel)
+
+    def put(self, channel, item):
+        """
+        Stores item as the object of channel and writes the file.
+        """
+        self.items[channel] = item
+        self.save()
+
+    def save(self):
+        """
+        Writes the objects to disk.
+        """
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok = True)
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(dict((str(channel), item.toDict())
+                           for channel, item in self.items.items()),
+                      f, indent = 1)
+        os.replace(temp, self.path)
@@ -0,0 +1,227 @@
+# darkLibrary - keeps master dark frames on disk between sessions
+#
+# Every master dark is stored as a .npy file in the library folder and is
+# described in index.json by the settings it was taken with: exposure time,
+# binning, start position, image size, readout speed and set CCD
+# temperature. Darks are loaded memory-mapped, so looking one up costs
+# nothing until its pixels are used. A dark replacing another is written
+# to a new file and the index is then pointed at it, so a mapped dark is
+# never overwritten; the old file is deleted once nothing maps it. When
+# the files grow past the disk budget the least recently used darks are
+# deleted, those still mapped on Windows staying in the index until they
+# can be. Lookups only note when a dark was used, the index is written
+# with the next dark stored or deleted.
+#
+#Brief Usage:
+#    Open (or create) a library:
+#        library = DarkLibrary('C:/Lab/FPWC/hardware/darks', budget = 2e9)
+#    Describe the camera settings of a dark:
+#        key = darkKey(expTime, (binX, binY), startPos, imgSize, readout,
+#                      ccdtemp)
+#    Store and find a master dark:
+#        library.store(key, darkFrame, numIm)
+#        darkFrame = library.lookup(key)
+#        # returns None if no dark with exactly these settings is stored
+#    Find the closest exposure time taken with otherwise matching settings:
+#        darkFrame, found = library.nearest(key)
+#        # found is the key of the returned dark, or None
+
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+
+def darkKey(expTime, binPix, startPos, imgSize, readout, ccdtemp):
+    """
+    Returns a dictionary describing the camera settings of a dark frame.
+    """
+    return {'expTime': float(expTime),
+            'binPix': [int(binPix[0]), int(binPix[1])],
+            'startPos': [int(startPos[0]), int(startPos[1])],
+            'imgSize': [int(imgSize[0]), int(imgSize[1])],
+            'readout': readout if isinstance(readout, str) else int(readout),
+            'ccdtemp': None if ccdtemp is None else float(ccdtemp)}
+
+
+class DarkLibrary:
+    """
+    A folder of master dark frames indexed by the camera settings they were
+    taken with.
+    """
+
+    def __init__(self, folder, budget = 2e9, tempTolerance = 0.5):
+        """
+        Opens the library in folder, creating it if needed. budget is the
+        most bytes of darks kept on disk, and darks count as taken at the
+        same temperature if their set temperatures differ by at most
+        tempTolerance degrees.
+        """
+        self.folder = folder
+        self.budget = budget
+        self.tempTolerance = tempTolerance
+        os.makedirs(folder, exist_ok = True)
+        self.indexFile = os.path.join(folder, 'index.json')
+        if os.path.exists(self.indexFile):
+            with open(self.indexFile) as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
+        # the file of every stored key
+        self.files = dict((self.name(entry['key']), name)
+                          for name, entry in self.entries.items()
+                          if not entry.get('replaced'))
+
+    def save(self):
+        """
+        Writes the index to disk.
+        """
+        temp = self.indexFile + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(self.entries, f, indent = 1)
+        os.replace(temp, self.indexFile)
+
+    def name(self, key):
+        """
+        Returns the name of the settings in key, which the files of their
+        darks start with.
+        """
+        text = json.dumps(key, sort_keys = True)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+    def remove(self, name):
+        """
+        Deletes the dark file name and returns True, or returns False if
+        it cannot be deleted, e.g. because it is still memory-mapped on
+        Windows.
+        """
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        return True
+
+    def store(self, key, darkFrame, numIm = None):
+        """
+        Saves darkFrame as the master dark for key, replacing any dark
+        with the same settings, and evicts old darks if over budget.
+        """
+        # a new file every time, the old one may be mapped by a reader
+        name = '%s.%x.npy' % (self.name(key), time.time_ns())
+        path = os.path.join(self.folder, name)
+        temp = path + '.tmp.npy'
+        np.save(temp, np.asarray(darkFrame, np.float32))
+        os.replace(temp, path)
+        old = self.files.get(self.name(key))
+        self.entries[name] = {'key': key, 'numIm': numIm,
+                              'bytes': os.path.getsize(path),
+                              'created': time.time(),
+                              'used': time.time()}
+        self.files[self.name(key)] = name
+        if old is not None:
+            # forgotten now, but still counted until the file is gone
+            entry = self.entries.pop(old)
+            if not self.remove(old):
+                self.entries[old] = dict(entry, replaced = True)
+        self.evict(keep = name)
+        self.save()
+
+    def load(self, name):
+        """
+        Returns the dark stored under name memory-mapped, and marks it as
+        recently used. Returns None if its file has gone missing.
+        """
+        path = os.path.join(self.folder, name)
+        if not os.path.exists(path):
+            self.forget(name)
+            self.save()
+            return None
+        self.entries[name]['used'] = time.time()
+        return np.load(path, mmap_mode = 'r')
+
+    def forget(self, name):
+        """
+        Drops the dark file name from the index.
+        """
+        entry = self.entries.pop(name)
+        if self.files.get(self.name(entry['key'])) == name:
+            del self.files[self.name(entry['key'])]
+
+    def lookup(self, key):
+        """
+        Returns the dark taken with exactly the settings in key, or None.
+        """
+        name = self.files.get(self.name(key))
+        if name is None:
+            return None
+        return self.load(name)
+
+    def compatible(self, key, other):
+        """
+        Returns True if other has the same binning, region and readout
+        speed as key, and a set temperature within tempTolerance.
+        """
+        for field in ('binPix', 'startPos', 'imgSize', 'readout'):
+            if key[field] != other[field]:
+                return False
+        if key['ccdtemp'] is None or other['ccdtemp'] is None:
+            return key['ccdtemp'] == other['ccdtemp']
+        return abs(key['ccdtemp'] - other['ccdtemp']) <= self.tempTolerance
+
+    def matches(self, key):
+        """
+        Returns the (name, key) of every stored dark compatible with key,
+        sorted by how far their exposure times are from key's.
+        """
+        found = [(name, entry['key']) for name, entry in self.entries.items()
+                 if not entry.get('replaced') and
+                 self.compatible(key, entry['key'])]
+        found.sort(key = lambda item: abs(item[1]['expTime'] -
+                                          key['expTime']))
+        return found
+
+    def nearest(self, key):
+        """
+        Returns the compatible dark whose exposure time is closest to
+        key's, along with its key. Returns (None, None) if there is none.
+        """
+        darkFrame = self.lookup(key)
+        if darkFrame is not None:
+            return darkFrame, key
+        for name, found in self.matches(key):
+            darkFrame = self.load(name)
+            if darkFrame is not None:
+                return darkFrame, found
+        return None, None
+
+    def size(self):
+        """
+        Returns the number of bytes of darks in the library.
+        """
+        return sum(entry['bytes'] for entry in self.entries.values())
+
+    def evict(self, keep = None):
+        """
+        Deletes the least recently used darks until the library fits in
+        its budget, and replaced darks whenever they can be. The dark
+        named keep is never deleted. A dark whose file cannot be deleted
+        stays in the index and is tried again next time.
+        """
+        for name in [name for name, entry in self.entries.items()
+                     if entry.get('replaced')]:
+            if self.remove(name):
+                del self.entries[name]
+        byAge = sorted(self.entries, key = lambda n: self.entries[n]['used'])
+        total = self.size()
+        for name in byAge:
+            if total <= self.budget:
+                break
+            if name == keep:
+                continue
+            # still memory-mapped somewhere on Windows, keep it for now
+            if self.remove(name):
+                total -= self.entries[name]['bytes']
+                self.forget(name)
@@ -0,0 +1,106 @@
+# darkModel - synthesizes dark frames for any exposure time
+#
+# A dark frame is modelled per pixel as a bias plus a dark current rate
+# times the exposure time. The two frames are fitted by least squares from
+# a few master darks taken at different exposure times with otherwise
+# matching settings, after which a dark for any exposure time is a single
+# multiply-add instead of a new stack of shutter-closed exposures.
+#
+#Brief Usage:
+#    Fit a model from darks at two or more exposure times:
+#        model = fitDarkModel(darks, expTimes)
+#    Fit a model from the compatible darks in a dark library:
+#        model = DarkModel.fromLibrary(library, key)
+#        # returns None if fewer than two exposure times are stored
+#    Synthesize a dark:
+#        darkFrame = model.synthesize(expTime)
+#        model.synthesize(expTime, out = darkFrame)
+#        # writes into an existing frame instead of making a new one
+
+import numpy as np
+
+
+class DarkModel:
+    """
+    A per-pixel bias frame and dark current rate frame (counts per second)
+    that together predict a dark frame for any exposure time.
+    """
+
+    def __init__(self, bias, rate, expTimes = None):
+        """
+        Creates a model from a bias frame and a rate frame of the same
+        shape. expTimes are the exposure times the model was fitted from.
+        """
+        if np.shape(bias) != np.shape(rate):
+            raise ValueError('Bias and rate frames must have the same shape')
+        self.bias = np.asarray(bias, np.float64)
+        self.rate = np.asarray(rate, np.float64)
+        self.expTimes = expTimes
+
+    def synthesize(self, expTime, out = None):
+        """
+        Returns the dark frame predicted for exposure time expTime, written
+        into out if it is given.
+        """
+        if out is None:
+            out = np.empty(self.bias.shape, np.float64)
+        np.multiply(self.rate, expTime, out = out)
+        out += self.bias
+        return out
+
+    def save(self, path):
+        """
+        Saves the model to a .npz file.
+        """
+        np.savez(path, bias = self.bias, rate = self.rate,
+                 expTimes = np.asarray(self.expTimes, np.float64))
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a model saved with save.
+        """
+        data = np.load(path)
+        return DarkModel(data['bias'], data['rate'], list(data['expTimes']))
+
+    @staticmethod
+    def fromLibrary(library, key):
+        """
+        Fits a model from every dark in library that is compatible with
+        key. Returns None if they span fewer than two exposure times.
+        """
+        darks = []
+        expTimes = []
+        for name, found in library.matches(key):
+            darkFrame = library.load(name)
+            if darkFrame is not None:
+                darks.append(darkFrame)
+                expTimes.append(found['expTime'])
+        if len(set(expTimes)) < 2:
+            return None
+        return fitDarkModel(darks, expTimes)
+
+
+def fitDarkModel(darks, expTimes):
+    """
+    Fits a DarkModel to a sequence of dark frames taken at expTimes by
+    least squares. The darks are read one at a time, so they can be
+    memory-mapped files.
+    """
+    t = np.asarray(expTimes, np.float64)
+    if len(darks) != len(t):
+        raise ValueError('Need one exposure time per dark frame')
+    if len(np.unique(t)) < 2:
+        raise ValueError('Darks must span at least two exposure times')
+    dt = t - t.mean()
+    sxx = np.dot(dt, dt)
+    # rate = sum(dt * dark) / sxx and bias = mean(dark) - rate * mean(t)
+    rate = np.zeros(np.shape(darks[0]), np.float64)
+    mean = np.zeros(np.shape(darks[0]), np.float64)
+    for weight, darkFrame in zip(dt, darks):
+        rate += weight * np.asarray(darkFrame, np.float64)
+        mean += darkFrame
+    rate /= sxx
+    mean /= len(t)
+    mean -= rate * t.mean()
+    return DarkModel(mean, rate, list(t))
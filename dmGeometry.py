@@ -0,0 +1,119 @@
+# dmGeometry - maps DM commands from active actuator order to driver order
+#
+# DM commands are vectors over the active actuators, DM.activeActIndex
+# picking them out of the Nact x Nact actuator grid (a mask or a pair of
+# row and column arrays). The drivers see DM1 flipped left to right and
+# DM2 rotated by 180 degrees, so a command used to be scattered into a
+# grid, flipped or rotated, and gathered back. The same reordering is a
+# fixed permutation of the command vector, so DMGeometry works it out once
+# per DM configuration and every command is then a single gather. Active
+# actuators whose mirror image is not active get 0, like the grid version.
+# Commands may be batches, with the actuators along the last axis. The
+# geometry keeps a copy of activeActIndex and is worked out again whenever
+# DM.activeActIndex no longer equals it, even if it was edited in place.
+#
+#Brief Usage:
+#    Get the geometry of a DM, computed on first use and kept on DM:
+#        geometry = dmGeometry(DM)
+#    Reorder commands (or a k x nActive batch of them) for the drivers:
+#        DM1command = geometry.driverDM1(DM1command)
+#        DM2command = geometry.driverDM2(DM2command)
+
+import numpy as np
+
+
+def indexCopy(index):
+    """
+    Returns a copy of an array, or of a tuple of arrays, that later
+    changes to index do not reach.
+    """
+    if isinstance(index, tuple):
+        return tuple(np.array(part) for part in index)
+    return np.array(index)
+
+
+def sameIndex(index, other):
+    """
+    Returns True if two arrays, or tuples of arrays, hold the same values
+    and pick the same elements: a boolean mask never equals integer
+    indices.
+    """
+    if isinstance(index, tuple) or isinstance(other, tuple):
+        return (isinstance(index, tuple) and isinstance(other, tuple) and
+                len(index) == len(other) and
+                all(sameIndex(a, b) for a, b in zip(index, other)))
+    index = np.asarray(index)
+    other = np.asarray(other)
+    return ((index.dtype == np.bool_) == (other.dtype == np.bool_) and
+            np.array_equal(index, other))
+
+
+class DMGeometry:
+    """
+    The permutations taking DM1 and DM2 commands from active actuator
+    order to driver order.
+    """
+
+    def __init__(self, Nact, activeActIndex):
+        """
+        Works out the permutations for an Nact x Nact DM with the active
+        actuators activeActIndex.
+        """
+        self.Nact = Nact
+        # a copy, so an edit of the caller's index is noticed
+        self.activeActIndex = indexCopy(activeActIndex)
+        # the position of every active actuator in the command vector,
+        # and -1 for inactive ones
+        order = np.full((Nact, Nact), -1, np.intp)
+        self.nActive = order[activeActIndex].size
+        order[activeActIndex] = np.arange(self.nActive)
+        self.map1 = np.fliplr(order)[activeActIndex]
+        self.map2 = np.rot90(order, 2)[activeActIndex]
+        # whether some mirror images are inactive, needing a padded gather
+        self.gaps1 = bool(np.any(self.map1 < 0))
+        self.gaps2 = bool(np.any(self.map2 < 0))
+
+    def matches(self, DM):
+        """
+        Returns True if this geometry was computed for DM's configuration.
+        """
+        return (self.Nact == DM.Nact and
+                sameIndex(self.activeActIndex, DM.activeActIndex))
+
+    def reorder(self, command, permutation, gaps):
+        """
+        Returns command[..., permutation], with 0 where permutation is -1,
+        which only happens if gaps is True.
+        """
+        command = np.asarray(command)
+        if not gaps:
+            return command[..., permutation]
+        # index -1 picks the appended 0
+        padded = np.concatenate([command, np.zeros(command.shape[:-1] +
+                                                   (1,), command.dtype)],
+                                axis = -1)
+        return padded[..., permutation]
+
+    def driverDM1(self, command):
+        """
+        Returns the DM1 command(s) flipped left to right.
+        """
+        return self.reorder(command, self.map1, self.gaps1)
+
+    def driverDM2(self, command):
+        """
+        Returns the DM2 command(s) rotated by 180 degrees.
+        """
+        return self.reorder(command, self.map2, self.gaps2)
+
+
+def dmGeometry(DM):
+    """
+    Returns the DMGeometry of DM, computing it only when DM.Nact or the
+    values of DM.activeActIndex have changed since the last call.
+    """
+    geometry = getattr(DM, 'geometry', None)
+    if geometry is None or not geometry.matches(DM):
+        geometry = DMGeometry(DM.Nact, DM.activeActIndex)
+        DM.geometry = geometry
+    return geometry
@@ -0,0 +1,87 @@
+# exposureWait - waits for a QSI camera exposure to finish without
+#   spinning on the ImageReady property
+#
+# The camera knows how long the exposure will take, so most of the wait is
+# spent sleeping. Only the last part of the exposure (and the readout) is
+# polled, with the delay between ImageReady reads growing exponentially so
+# the COM bridge is not flooded with property reads.
+#
+#Brief Usage:
+#    Wait for an exposure started with handle.StartExposure:
+#        timing = waitForImage(handle, expTime)
+#        # timing['wait'] is the time spent waiting in seconds and
+#        # timing['polls'] is the number of ImageReady reads
+#    Wait with a timeout and a cancel flag:
+#        cancel = threading.Event()
+#        timing = waitForImage(handle, expTime, timeout = 30, cancel = cancel)
+#        # a TimeoutError is raised if the image is not ready in time and
+#        # an ExposureCancelled is raised once cancel.set() is called
+#    Time the readout of the image:
+#        img, readout = timedReadout(handle)
+
+import time
+
+
+class ExposureCancelled(Exception):
+    """
+    Raised by waitForImage when the wait is cancelled before the image
+    is ready.
+    """
+    pass
+
+
+def waitForImage(handle, expTime, timeout = None, cancel = None,
+                 sleepFraction = 0.9, firstPoll = 0.001, maxPoll = 0.05,
+                 backoff = 2.0):
+    """
+    Waits until handle.ImageReady is True for an exposure of expTime
+    seconds that has already been started. Sleeps for sleepFraction of the
+    exposure time, then polls ImageReady starting every firstPoll seconds
+    and multiplying the delay by backoff up to maxPoll seconds. If timeout
+    (in seconds, measured from the call) runs out a TimeoutError is raised.
+    If cancel is a threading.Event, setting it aborts the wait with an
+    ExposureCancelled. Returns a dictionary with the time spent waiting and
+    the number of ImageReady reads.
+    """
+    if timeout is None:
+        # leave plenty of room for the readout of a full frame
+        timeout = 2 * expTime + 30
+    start = time.perf_counter()
+    deadline = start + timeout
+    # sleep through most of the exposure, waking early if cancelled
+    bulk = min(sleepFraction * expTime, timeout)
+    if bulk > 0:
+        if cancel is not None:
+            if cancel.wait(bulk):
+                raise ExposureCancelled('Exposure wait was cancelled.')
+        else:
+            time.sleep(bulk)
+    # poll with an exponentially growing delay
+    delay = firstPoll
+    polls = 0
+    while True:
+        polls += 1
+        if handle.ImageReady:
+            break
+        now = time.perf_counter()
+        if now >= deadline:
+            raise TimeoutError('Image not ready after ' + str(timeout) +
+                               ' s, the exposure may have stalled.')
+        delay = min(delay, deadline - now)
+        if cancel is not None:
+            if cancel.wait(delay):
+                raise ExposureCancelled('Exposure wait was cancelled.')
+        else:
+            time.sleep(delay)
+        delay = min(delay * backoff, maxPoll)
+    return {'wait': time.perf_counter() - start, 'polls': polls}
+
+
+def timedReadout(handle):
+    """
+    Reads handle.ImageArray and returns it along with the time the
+    transfer took in seconds.
+    """
+    start = time.perf_counter()
+    img = handle.ImageArray
+    return img, time.perf_counter() - start
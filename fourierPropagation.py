@@ -0,0 +1,120 @@
+# fourierPropagation - full focal plane images of padded pupils, reusing
+#   buffers between calls
+#
+# Computes abs(fftshift(fft2(fftshift(largeImage)))) / its maximum, with
+# largeImage the pupil placed at the center of an N x N zero image, like
+# Fourier.py and the laser calibration do. The padded image is kept per
+# (N, pupil shape) and the pupil is written straight into its shifted
+# position, so nothing but the pupil is rewritten between calls. The
+# transform is a real-input FFT, which computes half the spectrum; the
+# other half is its mirror image (the spectrum of a real image is
+# Hermitian), so the magnitude is taken and normalized on the half
+# spectrum in place and then copied out mirrored and shifted. scipy.fft is
+# used with several worker threads when it is installed, numpy.fft
+# otherwise. N must be even.
+#
+#Brief Usage:
+#    Normalized focal plane of a pupil padded to 4096 x 4096:
+#        Fourier = focalPlane(image, 4096)
+#        # the array is reused by the next call with the same N, copy it
+#        # if it has to be kept
+#    With a separate cache and 8 threads:
+#        propagator = FourierPropagator(workers = 8)
+#        Fourier = propagator.focalPlane(image, 4096)
+
+import os
+import numpy as np
+try:
+    import scipy.fft as fftBackend
+except ImportError:
+    fftBackend = None
+
+
+class FourierPropagator:
+    """
+    Computes normalized focal plane images, caching the padded input and
+    output arrays per size.
+    """
+
+    def __init__(self, workers = None):
+        """
+        Creates an empty cache. workers is the number of FFT threads, by
+        default one per CPU. It is ignored without scipy.
+        """
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.padded = {}
+        self.magnitudes = {}
+        self.outputs = {}
+
+    def clear(self):
+        """
+        Frees every cached array.
+        """
+        self.padded = {}
+        self.magnitudes = {}
+        self.outputs = {}
+
+    def pad(self, image, N):
+        """
+        Returns fftshift of image placed at the center of an N x N zero
+        array, reusing the array cached for this size.
+        """
+        x, y = image.shape
+        if x > N or y > N:
+            raise ValueError('Pupil image is larger than the padded size')
+        key = (N, x, y)
+        if key not in self.padded:
+            self.padded[key] = np.zeros((N, N), np.float64)
+        padded = self.padded[key]
+        # the rows and columns the pupil lands on after the fftshift
+        rows = (int((N - x) / 2) + np.arange(x) + N // 2) % N
+        cols = (int((N - y) / 2) + np.arange(y) + N // 2) % N
+        padded[np.ix_(rows, cols)] = image
+        return padded
+
+    def rfft2(self, padded):
+        """
+        Returns the half spectrum of a real array.
+        """
+        if fftBackend is not None:
+            return fftBackend.rfft2(padded, workers = self.workers)
+        return np.fft.rfft2(padded)
+
+    def focalPlane(self, image, N):
+        """
+        Returns abs of the shifted FFT of image padded to N x N, divided
+        by its maximum. The returned array is reused by the next call with
+        the same N.
+        """
+        if N % 2:
+            raise ValueError('Padded size must be even')
+        image = np.asarray(image, np.float64)
+        half = self.rfft2(self.pad(image, N))
+        if N not in self.outputs:
+            self.magnitudes[N] = np.empty(half.shape, np.float64)
+            self.outputs[N] = np.empty((N, N), np.float64)
+        magnitude = self.magnitudes[N]
+        out = self.outputs[N]
+        # magnitude and normalization in place on the half spectrum
+        np.abs(half, out = magnitude)
+        magnitude /= magnitude.max()
+        h = N // 2
+        # columns h.. of the shifted image are the computed half
+        out[h:, h:] = magnitude[:h, :h]
+        out[:h, h:] = magnitude[h:, :h]
+        # columns ..h-1 are its mirror image through the origin
+        out[:h + 1, :h] = magnitude[h::-1, h:0:-1]
+        out[h + 1:, :h] = magnitude[N - 1:h:-1, h:0:-1]
+        return out
+
+
+# cache shared by callers that do not keep their own
+propagator = FourierPropagator()
+
+
+def focalPlane(image, N):
+    """
+    Returns the normalized focal plane of image padded to N x N using the
+    shared cache. The returned array is reused by the next call.
+    """
+    return propagator.focalPlane(image, N)
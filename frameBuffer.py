@@ -0,0 +1,94 @@
+# frameBuffer - lands camera readouts in preallocated numpy frames
+#
+# The QSI driver hands ImageArray back indexed as [x][y]. A FrameRing keeps
+# a fixed number of uint16 frames of shape (NumY, NumX) and copies each
+# readout into the next one, so the stacking loops never allocate a new
+# frame. If the driver already returns an array (or anything exposing the
+# buffer protocol) the copy is a single block copy, otherwise the nested
+# tuples are copied one column at a time so no full size temporary is made.
+#
+#Brief Usage:
+#    Create a ring for the current exposure properties:
+#        ring = FrameRing((numY, numX), depth = 4)
+#    Copy a readout into the next frame of the ring:
+#        img = ring.transfer(handle.ImageArray)
+#        # img is only valid until depth more frames have been transferred,
+#        # copy it if it needs to be kept longer
+
+import numpy as np
+
+
+class FrameRing:
+    """
+    A fixed size ring of preallocated frames that camera readouts are
+    copied into.
+    """
+
+    def __init__(self, shape, depth = 4, dtype = np.uint16):
+        """
+        Creates depth frames of the given (rows, columns) shape and dtype.
+        """
+        if len(shape) != 2:
+            raise ValueError('Wrong dimension of frame shape')
+        if depth < 1:
+            raise ValueError('Ring depth must be at least 1')
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.dtype = np.dtype(dtype)
+        self.frames = np.zeros((depth,) + self.shape, self.dtype)
+        self.index = -1
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    def next(self):
+        """
+        Advances the ring and returns the frame that is now current.
+        """
+        self.index = (self.index + 1) % len(self)
+        return self.frames[self.index]
+
+    def current(self):
+        """
+        Returns the most recently transferred frame.
+        """
+        if self.index < 0:
+            raise ValueError('No frame has been transferred yet')
+        return self.frames[self.index]
+
+    def transfer(self, imageArray):
+        """
+        Copies an [x][y] indexed ImageArray into the next frame of the ring
+        and returns that frame.
+        """
+        frame = self.next()
+        copyImageArray(imageArray, frame)
+        return frame
+
+
+def copyImageArray(imageArray, out):
+    """
+    Copies an [x][y] indexed ImageArray into out, a (y, x) shaped array,
+    without building an intermediate array of the whole image.
+    """
+    # the readout is indexed [x][y], so fill the transpose of out
+    outT = out.T
+    try:
+        view = memoryview(imageArray)
+    except TypeError:
+        view = None
+    if view is not None:
+        # arrays and buffers are copied in one go
+        src = np.asarray(view)
+        if src.shape != outT.shape:
+            raise ValueError('Image of shape ' + str(src.shape[::-1]) +
+                             ' does not fit frame of shape ' +
+                             str(out.shape))
+        np.copyto(outT, src, casting = 'unsafe')
+        return out
+    # nested tuples from the COM SAFEARRAY are copied a column at a time
+    if len(imageArray) != outT.shape[0]:
+        raise ValueError('Image width ' + str(len(imageArray)) +
+                         ' does not fit frame of shape ' + str(out.shape))
+    for x, column in enumerate(imageArray):
+        outT[x] = column
+    return out
@@ -0,0 +1,117 @@
+# frameStacker - streaming mean and variance of a stack of camera frames
+#
+# Frames are folded into a running per-pixel mean and sum of squared
+# deviations (Welford's method) in float64 buffers that are allocated once,
+# so a stack of any length only ever holds a few frames worth of memory and
+# cannot overflow. With clip set, a pixel value further than clip standard
+# deviations from that pixel's running mean is rejected, which removes
+# cosmic ray hits without keeping the whole stack around.
+#
+#Brief Usage:
+#    Stack frames as they come off the camera:
+#        stack = FrameStacker()
+#        for i in range(numIm):
+#            stack.add(camera.exposure(expTime))
+#        img = stack.mean
+#    Get the per-pixel variance and number of frames used:
+#        var = stack.variance()
+#        # stack.count holds the accepted frames for every pixel
+#    Reject cosmic rays more than 5 sigma away from the running mean:
+#        stack = FrameStacker(clip = 5)
+#        # stack.rejected holds the number of rejected pixel values
+
+import numpy as np
+
+
+class FrameStacker:
+    """
+    Accumulates frames in place into a running mean and variance, with
+    optional per-pixel sigma clipping.
+    """
+
+    def __init__(self, shape = None, clip = None, minFrames = 5):
+        """
+        Creates an empty stack. If shape is None the buffers are allocated
+        from the first frame added. Clipping only starts on a pixel once
+        minFrames values have been accepted for it, since the variance of
+        fewer values is too noisy to clip against.
+        """
+        if clip is not None and clip <= 0:
+            raise ValueError('Clip must be a positive number of sigmas')
+        self.clip = clip
+        self.minFrames = max(int(minFrames), 2)
+        self.frames = 0
+        self.rejected = 0
+        self.shape = None
+        if shape is not None:
+            self.allocate(shape)
+
+    def allocate(self, shape):
+        """
+        Allocates the accumulator and scratch buffers for frames of the
+        given shape.
+        """
+        self.shape = tuple(shape)
+        self.mean = np.zeros(self.shape, np.float64)
+        self.m2 = np.zeros(self.shape, np.float64)
+        self.count = np.zeros(self.shape, np.uint32)
+        self.delta = np.empty(self.shape, np.float64)
+        self.scratch = np.empty(self.shape, np.float64)
+        if self.clip is not None:
+            self.square = np.empty(self.shape, np.float64)
+            self.keep = np.empty(self.shape, np.bool_)
+            self.young = np.empty(self.shape, np.bool_)
+
+    def add(self, frame):
+        """
+        Folds one frame into the running mean and variance.
+        """
+        if self.shape is None:
+            self.allocate(np.shape(frame))
+        elif np.shape(frame) != self.shape:
+            raise ValueError('Frame of shape ' + str(np.shape(frame)) +
+                             ' does not match stack of shape ' +
+                             str(self.shape))
+        self.frames += 1
+        # deviation of the new frame from the running mean
+        np.subtract(frame, self.mean, out = self.delta)
+        if self.clip is None:
+            self.count += 1
+            # mean += delta / count
+            np.divide(self.delta, self.count, out = self.scratch)
+            self.mean += self.scratch
+            # m2 += delta * (frame - new mean)
+            np.subtract(frame, self.mean, out = self.scratch)
+            self.scratch *= self.delta
+            self.m2 += self.scratch
+            return
+        # keep values within clip sigmas, and every value of pixels that
+        # do not have enough history yet to estimate a sigma
+        np.less(self.count, self.minFrames, out = self.young)
+        np.subtract(self.count, 1.0, out = self.scratch)
+        np.maximum(self.scratch, 1.0, out = self.scratch)
+        np.divide(self.m2, self.scratch, out = self.scratch)
+        self.scratch *= self.clip * self.clip
+        np.multiply(self.delta, self.delta, out = self.square)
+        np.less_equal(self.square, self.scratch, out = self.keep)
+        self.keep |= self.young
+        self.rejected += self.keep.size - int(np.count_nonzero(self.keep))
+        self.count += self.keep
+        # update the mean and m2 of the kept pixels only
+        np.divide(self.delta, self.count, out = self.scratch,
+                  where = self.keep)
+        np.add(self.mean, self.scratch, out = self.mean, where = self.keep)
+        np.subtract(frame, self.mean, out = self.scratch)
+        self.scratch *= self.delta
+        np.add(self.m2, self.scratch, out = self.m2, where = self.keep)
+
+    def variance(self):
+        """
+        Returns the per-pixel sample variance of the accepted frames.
+        """
+        if self.shape is None:
+            raise ValueError('No frames have been added')
+        var = np.zeros(self.shape, np.float64)
+        np.divide(self.m2, self.count - 1.0, out = var,
+                  where = self.count > 1)
+        return var
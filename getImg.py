@@ -11,39 +11,61 @@
 # estimator - defines the parameters of wavefront estimator
 # DM1command, DM2command - the current voltage commands of DMs
 # simOrLab - 'simulation for taking simulated image, 'lab' for real ones
+#
+# If camera.autoExposure is an AutoExposure, getLabImg retakes saturated
+# stacks at a shorter exposure time and sets camera.exposure for the next
+# image from the peak of this one, taken over the rotated and cropped image
+# its mask is defined on. camera.lastExposure is the exposure time the
+# returned image was taken with. The dark subtracted is always one of that
+# exposure time: synthesized by camera.darkModel, stored in the dark
+# library, or camera.darkFrame if camera.darkExposure says it was taken at
+# it; getLabImg raises a ValueError if there is none.
+#
+# getSimImg simulates the image with simulationEngine.py (see there for the
+# attributes of target, DM, coronagraph and camera it uses) and takes k x
+# nActive batches of commands as well, returning k images. Only the lab
+# path needs the camera driver (CCDCclasses and win32com), so simulations
+# run on any machine.
 
 import numpy
-import CCDCclasses
+from autoExposure import SaturationError, checkSaturation, saturationLevel
+from dmGeometry import dmGeometry
+from simulationEngine import simulationEngine, addCameraNoise
+
+# times a saturated stack is retaken at a shorter exposure time
+maxRetakes = 3
 
 def getSimImg(target, DM, coronagraph, camera, DM1command, DM2command):
     """ A function that getes a simulated image with a specific DM command"""
-    # add noises to the DM volatege input
-# CONFIRM THIS IS A BOOLEAN AND NOT A VALUE OF 1
-    if DM.noise == True:
+    # add noises to the DM volatege input, without changing the caller's
+    # commands
+    if getattr(DM, 'noise', False):
         voltageNoise1 = DM.DMvoltageStd * numpy.multiply(
-                DM1command, numpy.random.randn(numpy.ndarray(DM1command)))
-# IN ORIGINAL CODE THERE IS A DM1COMMAND HERE. SHOULD IT BE A DM2COMMAND
+                DM1command, numpy.random.randn(*numpy.shape(DM1command)))
         voltageNoise2 = DM.DMvoltageStd * numpy.multiply(
-                DM2command, numpy.random.randn(numpy.ndarray(DM1command)))
-        DM1command += voltageNoise1
-        DM2command += voltageNoise2
-    # simulate the image
-###########
-    ########### FINISH SIMULATING IMAGE
-    ###########
+                DM2command, numpy.random.randn(*numpy.shape(DM2command)))
+        DM1command = DM1command + voltageNoise1
+        DM2command = DM2command + voltageNoise2
+    # simulate the image with the operators cached for this setup
+    engine = simulationEngine(target, DM, coronagraph, camera)
+    I = engine.image(DM1command, DM2command)
+    if getattr(camera, 'noise', False):
+        I = addCameraNoise(I, getattr(target, 'flux', 1e10) * camera.exposure,
+                           getattr(camera, 'readoutstd', 12.0),
+                           getattr(camera, 'darkCurrent', 0.01) *
+                           camera.exposure)
+    return I
     
 def getLabImg(target, DM, camera, DM1command, DM2command):
     """ A function that gets a lab image with specific DM commands"""
+    # imported here so simulations run without the Windows camera driver
+    import CCDCclasses
     # Sends commands to deformable mirrors
-    # flip or rotate teh DM commands
-    DM1command2D = numpy.zeros((DM.Nact, DM.Nact))
-    DM2command2D = numpy.zeros((DM.Nact, DM.Nact))
-    DM1command2D[DM.activeActIndex] = DM1command
-    DM2command2D[DM.activeActIndex] = DM2command
-    DM1command2D = numpy.fliplr(DM1command2D)
-    DM2command2D = numpy.rot90(DM2command2D, 2)
-    DM1command = DM1command2D[DM.activeActIndex]
-    DM2command = DM2command2D[DM.activeActIndex]
+    # flip or rotate teh DM commands, with the permutations worked out
+    # once per DM configuration
+    geometry = dmGeometry(DM)
+    DM1command = geometry.driverDM1(DM1command)
+    DM2command = geometry.driverDM2(DM2command)
     # send commands to DMs
     # calculate true voltage inputs by adding command to flat voltage
     DM1VOltage = DM.DM1bias + DM1command
@@ -52,26 +74,84 @@ def getLabImg(target, DM, camera, DM1command, DM2command):
     ###########
     ########### insert code sending commands to DM driver
     ############
-    # take lab image using QSI camera
-    I = CCDCclasses.takeImg(camera.handle, camera.stacking, camera.exposure,
-                            camera.startPosition, camera.imageSize,
-                            (camera.binXi, camera.binEta))
-    # check whether the camera is saturated
-    if numpy.amax(I) > 3.3e5:
-        raise ValueError('The camera image is saturated!! STOP!!')
-    # subtract the dark frame
-    I = numpy.rot90(I - camera.darkFrame, 1)
-    if camera.Nxi % 2 == 0:
-        xiCrop = (-camera.Nxi/2 + 1, camera.Nxi/2)
-    else:
-        xiCrop = (-numpy.floor(camera.Nxi/2), numpy.floor(camera.Nxi/2))
-    if camera.Neta % 2 == 0:
-        etaCrop = (-numpy.floor(camera.Neta/2), numpy.floor(camera.Neta/2))
+    # take lab image using QSI camera, subtracting the dark frame from each
+    # frame on a worker thread while the next one is exposed. The stack
+    # stops as soon as a frame is saturated
+    autoExposure = getattr(camera, 'autoExposure', None)
+    for attempt in range(maxRetakes + 1):
+        darkFrame = labDark(camera)
+        try:
+            I = CCDCclasses.takeImg(camera.handle, camera.stacking,
+                                    camera.exposure, camera.startPosition,
+                                    camera.imageSize,
+                                    (camera.binXi, camera.binEta),
+                                    process = darkSubtractor(darkFrame))
+            break
+        except SaturationError:
+            # retake at a shorter exposure time if allowed to pick one
+            if autoExposure is None or attempt == maxRetakes:
+                raise
+            expTime = autoExposure.saturated(camera.exposure)
+            if expTime >= camera.exposure:
+                raise
+            camera.exposure = expTime
+    camera.lastExposure = camera.exposure
+    I = numpy.rot90(I, 1)
     # crop the camera output to specific size
-#####
-    #######
-    ####### need to do cropping of I still
-    #########
+    I = cropCenter(I, camera.Nxi, camera.Neta)
+    # predict the exposure time of the next image from this one, on the
+    # image the dark hole mask is defined on
+    if autoExposure is not None:
+        camera.exposure = autoExposure.update(I, camera.exposure)
+    return I
+
+def cropRange(N, size):
+    """ A function that returns the indices of the N pixels around the
+    center pixel (size - 1)//2 of an axis of size pixels, one more after
+    the center than before it for even N"""
+    if N % 2 == 0:
+        crop = (-N//2 + 1, N//2)
+    else:
+        crop = (-(N//2), N//2)
+    if N > size:
+        raise ValueError('Cannot crop ' + str(N) + ' pixels out of ' +
+                         str(size))
+    return numpy.arange(crop[0], crop[1] + 1) + (size - 1)//2
+
+def cropCenter(I, Nxi, Neta):
+    """ A function that crops the central Nxi x Neta pixels of I"""
+    return I[numpy.ix_(cropRange(Nxi, I.shape[0]),
+                       cropRange(Neta, I.shape[1]))]
+    
+def labDark(camera):
+    """ A function that returns the dark frame for the current exposure
+    time, synthesized from the dark model when one is fitted, otherwise
+    stored in the dark library or camera.darkFrame if it was taken at it.
+    Raises a ValueError rather than return a dark of another exposure time
+    """
+    import CCDCclasses
+    if getattr(camera, 'darkModel', None) is not None:
+        return camera.darkModel.synthesize(camera.exposure)
+    darkFrame = CCDCclasses.storedDark(camera.handle, camera.exposure,
+                                       camera.binXi, camera.binEta)
+    if darkFrame is not None:
+        return darkFrame
+    darkExposure = getattr(camera, 'darkExposure', None)
+    # without automatic exposure the exposure time never changes here
+    if darkExposure == camera.exposure or (
+            darkExposure is None and
+            getattr(camera, 'autoExposure', None) is None):
+        return camera.darkFrame
+    raise ValueError('No dark for exposure time ' + str(camera.exposure) +
+                     ', fit camera.darkModel or store a dark of it')
+
+def darkSubtractor(darkFrame):
+    """ A function that returns the per-frame processing of a lab stack:
+    stop on a saturated frame, otherwise subtract the dark frame"""
+    def process(frame):
+        checkSaturation(frame, saturationLevel)
+        return frame - darkFrame
+    return process
     
 def getImg(target, DM, coronagraph, camera, DM1command, DM2command, simOrLab):
     # check the DM commands don't exceed upper limit
@@ -81,7 +161,7 @@ def getImg(target, DM, coronagraph, camera, DM1command, DM2command, simOrLab):
         raise ValueError('DM COMMANDS EXCEED LIMIT!!')
     if numpy.amax(numpy.absolute(DM1command)) > DM.voltageLimit:
         raise ValueError('DM COMMANDS EXCEED LIMIT!!')
-    if numpy.amax(numpy.abs(DM2command)) > DM.voltagelimit:
+    if numpy.amax(numpy.abs(DM2command)) > DM.voltageLimit:
        raise ValueError('DM COMMANDS EXCEED LIMIT!!')
     # take simulated or lab image
     simOrLab = simOrLab.lower()
@@ -0,0 +1,77 @@
+# hdrMerge - merges frames of several exposure times into one HDR frame
+#
+# Each pixel of the merged frame is a count rate in counts per second. For
+# every pixel the dark subtracted counts of all exposures in which it is
+# not saturated are added up and divided by the total exposure time of
+# those exposures, which is the maximum likelihood rate for Poisson counts
+# and weights each exposure by its exposure time. Pixels saturated in
+# every exposure fall back to the rate of the shortest exposure and are
+# flagged. Frames are folded in one at a time, so the stack is never kept.
+#
+#Brief Usage:
+#    Merge frames as they are taken:
+#        merge = HDRMerge(saturation = 60000)
+#        for expTime in expTimes:
+#            merge.add(camera.avgimg(expTime, numIm), expTime, darkFrame)
+#        rate, saturated = merge.result()
+#        # rate is in counts per second, saturated marks pixels that were
+#        # saturated in every exposure
+
+import numpy as np
+
+
+class HDRMerge:
+    """
+    Streams frames of different exposure times into a linear count rate.
+    """
+
+    def __init__(self, saturation = 60000):
+        """
+        Creates an empty merge. Raw pixel values at or above saturation
+        are left out.
+        """
+        self.saturation = saturation
+        self.shape = None
+        self.shortest = None
+
+    def add(self, frame, expTime, darkFrame = None):
+        """
+        Folds in a frame of exposure time expTime, subtracting darkFrame
+        if it is given.
+        """
+        if expTime <= 0:
+            raise ValueError('Exposure time must be positive')
+        frame = np.asarray(frame)
+        if self.shape is None:
+            self.shape = frame.shape
+            self.counts = np.zeros(self.shape, np.float64)
+            self.time = np.zeros(self.shape, np.float64)
+            self.fallback = np.zeros(self.shape, np.float64)
+            self.good = np.empty(self.shape, np.bool_)
+            self.signal = np.empty(self.shape, np.float64)
+        elif frame.shape != self.shape:
+            raise ValueError('Frame of shape ' + str(frame.shape) +
+                             ' does not match merge of shape ' +
+                             str(self.shape))
+        np.less(frame, self.saturation, out = self.good)
+        np.copyto(self.signal, frame)
+        if darkFrame is not None:
+            self.signal -= darkFrame
+        np.add(self.counts, self.signal, out = self.counts,
+               where = self.good)
+        np.add(self.time, expTime, out = self.time, where = self.good)
+        if self.shortest is None or expTime < self.shortest:
+            self.shortest = expTime
+            np.divide(self.signal, expTime, out = self.fallback)
+
+    def result(self):
+        """
+        Returns the merged count rate and a mask of the pixels saturated
+        in every exposure.
+        """
+        if self.shape is None:
+            raise ValueError('No frames have been added')
+        saturated = self.time == 0
+        rate = self.fallback.copy()
+        np.divide(self.counts, self.time, out = rate, where = ~saturated)
+        return rate, saturated
@@ -0,0 +1,101 @@
+# imageCache - loads pupil images, parsing text files only once
+#
+# loadImage accepts an array, which is passed straight through, or the path
+# of an image file. A text image (anything np.loadtxt reads) is parsed the
+# first time and saved next to it as a binary .npy sidecar named after the
+# hash of the text, e.g. image.txt.0123456789abcdef.npy. Later loads of the
+# same text find the sidecar and map it from disk without parsing; if the
+# text file changes its hash changes, so the old sidecar is never used and
+# is deleted when the new one is written. The sidecars can be kept in
+# cacheFolder instead, e.g. when the folder of the image is not writable;
+# there their names also hold a hash of the image's full path, so images of
+# the same name from different folders keep their own sidecars. If that
+# fails too the parsed image is returned uncached. .npy files are
+# mapped directly.
+#
+#Brief Usage:
+#    Load a pupil image from a text file (or pass an array through):
+#        image = loadImage('//mac/Home/Desktop/ripple3_256x256_ideal_undersized.txt')
+#        image = loadImage(image)
+#        # the array is read-only when it comes from a file, copy it to
+#        # change it
+#    Keep the sidecars in another folder:
+#        image = loadImage(path, cacheFolder = 'C:/Lab/FPWC/cache')
+
+import glob
+import hashlib
+import os
+import numpy as np
+
+
+def contentHash(path):
+    """
+    Returns the first 16 hex digits of the sha1 of the file at path.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def sidecarPath(path, cacheFolder = None):
+    """
+    Returns where the .npy sidecar of the text image at path is stored.
+    In cacheFolder the name also holds a hash of the full path of the
+    image, which images of the same name in other folders do not share.
+    """
+    name = os.path.basename(path)
+    if cacheFolder is None:
+        folder = os.path.dirname(os.path.abspath(path))
+    else:
+        folder = cacheFolder
+        source = os.path.normcase(os.path.abspath(path))
+        name += '.' + hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(folder, name + '.' + contentHash(path) + '.npy')
+
+
+def writeSidecar(image, sidecar):
+    """
+    Saves image as sidecar and deletes older sidecars of the same image.
+    Returns False if the folder is not writable.
+    """
+    base = sidecar[:-len('.0123456789abcdef.npy')]
+    try:
+        os.makedirs(os.path.dirname(sidecar), exist_ok = True)
+        # written under a temporary name so no reader sees half a file
+        temp = sidecar + '.tmp.npy'
+        np.save(temp, image)
+        os.replace(temp, sidecar)
+    except OSError:
+        return False
+    for old in glob.glob(glob.escape(base) + '.*.npy'):
+        if old != sidecar and len(old) == len(sidecar):
+            try:
+                os.remove(old)
+            except OSError:
+                # still mapped somewhere on Windows, leave it
+                pass
+    return True
+
+
+def loadImage(source, cacheFolder = None):
+    """
+    Returns source as an array: arrays are returned as they are, .npy
+    files are mapped from disk and text files are parsed once and then
+    mapped from their sidecar.
+    """
+    if isinstance(source, np.ndarray):
+        return source
+    if not isinstance(source, (str, bytes, os.PathLike)):
+        return np.asarray(source)
+    path = os.fsdecode(source)
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode = 'r')
+    sidecar = sidecarPath(path, cacheFolder)
+    if os.path.exists(sidecar):
+        return np.load(sidecar, mmap_mode = 'r')
+    image = np.loadtxt(path)
+    if writeSidecar(image, sidecar):
+        return np.load(sidecar, mmap_mode = 'r')
+    return image
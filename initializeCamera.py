@@ -2,8 +2,9 @@
 # Developed by Matthew Grossman on Jun. 6, 2018
 # Based on a Matlab version developed by He Sun
 
-from CCDCclasses import Camera
-import Camera_ctrl
+from CCDCclasses import Camera, takeDarkCam, darkFolder
+from Camera_ctrl import Camera_ctrl
+from darkLibrary import DarkLibrary
 
 
 # creates a new camera object
@@ -19,10 +20,10 @@ camera.handle = Camera_ctrl(camera.handle, 'shutter', 1)
 # sets up the camera properties
 Camera_ctrl(camera.handle, 'exposureproperties', camera.startPosition,
             camera.imageSize, [camera.binXi, camera.binEta])
-# take new dark frame if needed
-if camera.newDarkFrame() == True:
-    numIm = 30
-    camera.darkFrame = takeDarkCam(camera.handle, camera.exposrure, numIm,
-                                   camera.binXi, camera.binEta)
-else:
-    camera.darkFrame = darkCam
\ No newline at end of file
+# take new dark frame if needed, otherwise load it from the dark library
+camera.handle.darkLibrary = DarkLibrary(darkFolder)
+numIm = 30
+camera.darkFrame = takeDarkCam(camera.handle, camera.exposure, numIm,
+                               camera.binXi, camera.binEta,
+                               camera.newDarkFrame() == True)
+camera.darkExposure = camera.exposure
\ No newline at end of file
@@ -0,0 +1,101 @@
+# laserBenchmark - measures laser control latency against SimulatedLaser
+#
+# Runs the laser control code used by Laser (LaserSession, LaserScheduler
+# and StatusMonitor) against a simulated laser source on a pseudo-terminal
+# and prints the time per command and per calibration cycle. A calibration
+# cycle retunes all four channels and reads a fresh status, like one step
+# of the calibration loop. Needs no hardware, only a Linux or macOS box.
+#
+#Brief Usage:
+#    From the command line:
+#        python laserBenchmark.py --latency 0.01 --jitter 0.002 --repeats 50
+#    From Python:
+#        results = benchmark(latency = 0.01, jitter = 0.002, repeats = 50)
+#        # results['command']['channel='] and results['cycle'] hold the
+#        # times in seconds of every repetition
+
+import argparse
+import time
+import numpy as np
+from laserSession import LaserSession
+from laserCommands import LaserScheduler, maxCurrent
+from laserStatus import StatusMonitor
+from laserSimulator import SimulatedLaser
+
+
+def timeit(function, repeats):
+    """
+    Calls function repeats times and returns the wall time of each call.
+    """
+    times = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        function(i)
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def summary(times):
+    """
+    Returns a line with the mean, median and 95th percentile of times in
+    milliseconds.
+    """
+    return ('mean %7.2f ms  p50 %7.2f ms  p95 %7.2f ms' %
+            (1000 * np.mean(times), 1000 * np.median(times),
+             1000 * np.percentile(times, 95)))
+
+
+def benchmark(latency = 0.01, jitter = 0.0, repeats = 50, reader = True,
+              seed = 0):
+    """
+    Times single commands and calibration cycles against a simulated
+    laser. If reader is True the session drains the port on a background
+    thread, as Laser does. Returns a dictionary of the times in seconds.
+    """
+    sim = SimulatedLaser(latency, jitter, seed)
+    session = LaserSession(sim.port)
+    if reader:
+        session.startReader()
+    scheduler = LaserScheduler(session)
+    monitor = StatusMonitor(session)
+    try:
+        results = {'command': {}}
+        results['command']['channel='] = timeit(
+                lambda i: session.command('channel=' + str(i % 4 + 1)),
+                repeats)
+        results['command']['current='] = timeit(
+                lambda i: session.command('current=' + str(10 + i % 20)),
+                repeats)
+        results['command']['statword?'] = timeit(
+                lambda i: monitor.fresh(), repeats)
+
+        def cycle(i):
+            # retune every channel, then check the laser is happy
+            scheduler.setpoints(dict((c, 0.5 * maxCurrent[c] + 0.01 * i)
+                                     for c in maxCurrent))
+            monitor.fresh()
+
+        results['cycle'] = timeit(cycle, repeats)
+        results['simulatedCommands'] = sim.commands
+    finally:
+        session.close()
+        sim.close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Time laser control '
+                                     'against a simulated laser source.')
+    parser.add_argument('--latency', type = float, default = 0.01,
+                        help = 'simulated response latency in seconds')
+    parser.add_argument('--jitter', type = float, default = 0.0,
+                        help = 'standard deviation of the latency')
+    parser.add_argument('--repeats', type = int, default = 50)
+    parser.add_argument('--no-reader', action = 'store_true',
+                        help = 'read replies without the reader thread')
+    args = parser.parse_args()
+    results = benchmark(args.latency, args.jitter, args.repeats,
+                        not args.no_reader)
+    for name, times in results['command'].items():
+        print('%-12s %s' % (name, summary(times)))
+    print('%-12s %s' % ('cycle', summary(results['cycle'])))
@@ -0,0 +1,119 @@
+# laserCommands - sends the fewest commands needed to reach new laser
+#   setpoints
+#
+# The laser source has one active channel, and enable= and current= act on
+# it. A LaserScheduler remembers which channel is active and the enable
+# state and current of every channel it has set, so a batch of setpoints
+# for several channels is checked against the maximum currents first and
+# then turned into the shortest command sequence: channels that already
+# have the requested current are skipped, the active channel is handled
+# first so it is not selected again, and enable= is only sent when it
+# changes. What the laser does outside the scheduler is unknown to it, so
+# invalidate() must be called after, e.g., switching the system off.
+#
+#Brief Usage:
+#    Create a scheduler on a laser session:
+#        scheduler = LaserScheduler(session)
+#    Set the currents (in mA) of several channels, 0 turns a channel off:
+#        scheduler.setpoints({1: 30.0, 2: 0, 4: 55.5})
+#        # raises ValueError without sending anything if any is invalid
+#    See the commands a batch would send:
+#        commands = scheduler.plan({1: 30.0, 2: 0})
+
+# maximum current of each channel in mA
+maxCurrent = {1: 68.09, 2: 63.89, 3: 41.59, 4: 67.39}
+
+
+def checkSetpoint(channel, current):
+    """
+    Raises a ValueError if channel does not exist or current is outside
+    [0, maximum current of channel].
+    """
+    if channel not in maxCurrent:
+        raise ValueError('No Way! channel shall be 1, 2, 3, or 4 only!')
+    if current < 0 or current > maxCurrent[channel]:
+        raise ValueError('No Way! current of channel ' + str(channel) +
+                         ' must be between 0 and ' +
+                         str(maxCurrent[channel]) + ' mA only.')
+
+
+class LaserScheduler:
+    """
+    Turns batches of per-channel current setpoints into the fewest
+    commands for the laser and sends them.
+    """
+
+    def __init__(self, session):
+        """
+        Creates a scheduler that sends its commands through session.
+        Nothing is assumed about the state of the laser yet.
+        """
+        self.session = session
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forgets the remembered state of the laser.
+        """
+        self.channel = None
+        self.enabled = {}
+        self.current = {}
+
+    def plan(self, setpoints):
+        """
+        Checks a dictionary of channel: current setpoints and returns the
+        list of commands that reach them from the remembered state.
+        """
+        for channel, current in setpoints.items():
+            checkSetpoint(channel, current)
+        # the active channel first saves selecting it again
+        order = sorted(setpoints, key = lambda c: (c != self.channel, c))
+        commands = []
+        active = self.channel
+        for channel in order:
+            current = setpoints[channel]
+            steps = []
+            if current == 0:
+                if self.enabled.get(channel) != False:
+                    steps.append('enable=0')
+            else:
+                if self.current.get(channel) != current:
+                    steps.append('current=' + str(current))
+                if self.enabled.get(channel) != True:
+                    steps.append('enable=1')
+            if not steps:
+                continue
+            if channel != active:
+                commands.append('channel=' + str(channel))
+                active = channel
+            commands.extend(steps)
+        return commands
+
+    def setpoints(self, setpoints):
+        """
+        Sends the fewest commands that bring the channels to the currents
+        in the channel: current dictionary setpoints. Returns the commands
+        that were sent.
+        """
+        commands = self.plan(setpoints)
+        for command in commands:
+            # a failed command leaves the state unknown
+            try:
+                self.session.command(command)
+            except Exception:
+                self.invalidate()
+                raise
+            self.remember(command)
+        return commands
+
+    def remember(self, command):
+        """
+        Updates the remembered state after command was acknowledged.
+        """
+        name, value = command.split('=')
+        if name == 'channel':
+            self.channel = int(value)
+        elif name == 'enable':
+            self.enabled[self.channel] = value == '1'
+        elif name == 'current':
+            self.current[self.channel] = float(value)
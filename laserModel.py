@@ -0,0 +1,164 @@
+# laserModel - calibrates a laser channel to a target intensity in a few
+#   measurements
+#
+# The peak intensity of a diode channel is modelled as
+#     intensity = slope * (current - threshold)
+# above threshold. Scaling the current by target / intensity only works if
+# the threshold is 0, which it is not, so repeated calibrations used to be
+# needed. closedLoop instead sets a current, measures the intensity and
+# refits the model to the measurements: the line through the last two
+# (a secant step), or the stored model corrected by the one measurement
+# there is at first. It then sets the current the model gives for the
+# target, until the intensity is within tolerance. Saturated measurements
+# do not fit the line and only halve the step. It gives up early when the
+# next current would be the last one again, e.g. when the target needs more
+# than maxCurrent, and says whether it converged. Only converged models
+# should be kept: they are stored per channel in a json file (see
+# channelStore.py), so the next session starts from the right current.
+#
+#Brief Usage:
+#    Open the stored models:
+#        models = LaserModels('C:/Lab/FPWC/hardware/laserModels.json')
+#    Bring channel 2 to 90% of saturation, measure() returning the peak
+#    as a fraction of saturation after setCurrent(current) was called:
+#        result = closedLoop(setCurrent, measure, models.get(2),
+#                            target = 0.9, maxCurrent = 63.89)
+#        if result['converged']:
+#            models.put(2, result['model'])
+#        # result['current'], result['intensity'], result['steps']
+
+import time
+from channelStore import ChannelStore
+
+
+class ResponseModel:
+    """
+    Linear above threshold model of the peak intensity of a laser channel
+    against its current.
+    """
+
+    def __init__(self, slope, threshold = 0.0, updated = None):
+        """
+        Creates the model intensity = slope * (current - threshold).
+        """
+        self.slope = slope
+        self.threshold = threshold
+        self.updated = updated
+
+    def intensity(self, current):
+        """
+        Returns the modelled intensity at current.
+        """
+        return max(0.0, self.slope * (current - self.threshold))
+
+    def current(self, intensity):
+        """
+        Returns the current the model gives intensity at.
+        """
+        return self.threshold + intensity / self.slope
+
+    def fit(self, points):
+        """
+        Refits the model to the (current, intensity) measurements in
+        points, which are above threshold and not saturated: the line
+        through the last two, or a new slope through the last one.
+        """
+        current, intensity = points[-1]
+        if len(points) > 1:
+            previous, previousIntensity = points[-2]
+            if current != previous:
+                slope = (intensity - previousIntensity) / (current - previous)
+                # noise can make the secant useless, keep the old slope
+                if slope > 0:
+                    self.slope = slope
+            self.threshold = current - intensity / self.slope
+        elif current > self.threshold:
+            self.slope = intensity / (current - self.threshold)
+        else:
+            self.threshold = current - intensity / self.slope
+        self.updated = time.time()
+
+    def toDict(self):
+        """
+        Returns the model as a dictionary that can be written to json.
+        """
+        return {'slope': self.slope, 'threshold': self.threshold,
+                'updated': self.updated}
+
+    @classmethod
+    def fromDict(cls, values):
+        """
+        Creates a model from a dictionary written by toDict.
+        """
+        return cls(values['slope'], values['threshold'], values['updated'])
+
+
+class LaserModels(ChannelStore):
+    """
+    The response models of the laser channels, stored in a json file.
+    """
+
+    def __init__(self, path):
+        """
+        Reads the models stored in path, if it exists.
+        """
+        ChannelStore.__init__(self, path, ResponseModel.fromDict)
+
+
+def closedLoop(setCurrent, measure, model = None, target = 0.9,
+               tolerance = 0.01, maxSteps = 8, start = None,
+               maxCurrent = None, saturation = 1.0):
+    """
+    Changes the current with setCurrent(current) and reads the intensity
+    with measure() until it is within tolerance of target (both as
+    fractions of saturation), at most maxSteps times. Starts at start, or
+    at the current model gives for target, and stops early if the next
+    current would be the same as the last, which happens when it is
+    clamped at maxCurrent or 0. Returns a dictionary of whether it
+    'converged', the final 'current' and 'intensity', the number of
+    'steps', the measured 'points' and the fitted 'model'. Raises a
+    ValueError if there is neither a start nor a model.
+    """
+    if start is None:
+        if model is None:
+            raise ValueError('A start current is needed without a model')
+        start = model.current(target)
+    model = (ResponseModel(model.slope, model.threshold, model.updated)
+             if model is not None else None)
+    current = start
+    points = []
+    fitted = []
+    intensity = None
+    converged = False
+    for step in range(1, maxSteps + 1):
+        if maxCurrent is not None:
+            current = min(current, maxCurrent)
+        current = max(current, 0.0)
+        if points and current == points[-1][0]:
+            # measuring the same current again would not get any closer
+            break
+        setCurrent(current)
+        intensity = measure()
+        points.append((current, intensity))
+        if abs(intensity - target) <= tolerance:
+            converged = True
+            break
+        if intensity >= saturation:
+            # no information on the slope, halve the way back down
+            below = [c for c, i in fitted if c < current]
+            floor = max(below) if below else (
+                    model.threshold if model is not None else 0.0)
+            current = 0.5 * (floor + current)
+            continue
+        if intensity <= 0:
+            # below threshold, the line says nothing either
+            current = 2 * current if current > 0 else 1.0
+            continue
+        fitted.append((current, intensity))
+        if model is None:
+            model = ResponseModel(intensity / current)
+        model.fit(fitted)
+        current = model.current(target)
+    return {'converged': converged, 'current': points[-1][0],
+            'intensity': intensity, 'steps': len(points), 'points': points,
+            'model': model}
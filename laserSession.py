@@ -0,0 +1,201 @@
+# laserSession - keeps the serial port of the laser source open and waits
+#   for its replies
+#
+# The laser source echoes each command, prints any reply, and then prints
+# its prompt. A LaserSession opens the port once for its whole lifetime,
+# terminates every command with a carriage return, and returns as soon as
+# the prompt comes back instead of sleeping for a fixed time. If the prompt
+# does not arrive within the timeout a TimeoutError is raised.
+#
+# With startReader() a background thread drains the port continuously and
+# splits what arrives into lines. Commands then wait on the reply the
+# reader hands over instead of reading the port themselves, so nothing the
+# laser sends is left sitting in the input buffer.
+#
+#Brief Usage:
+#    Open a session:
+#        session = LaserSession('COM3', 115200, 8, 1)
+#    Send a command and wait for the laser to acknowledge it:
+#        reply = session.command('channel=2')
+#    Send a query and get its reply:
+#        statword = session.command('statword?')
+#    Drain the port on a background thread:
+#        session.startReader()
+#        # session.lines holds the most recent lines received
+#    Close the port:
+#        session.close()
+#        # or use the session in a with statement
+
+import collections
+import queue
+import threading
+import time
+import serial as s
+
+
+class LaserSession:
+    """
+    A persistent serial connection to the laser source that sends one
+    command at a time and waits for the prompt that acknowledges it.
+    """
+
+    def __init__(self, port, BaudRate = 115200, DataBits = 8, StopBits = 1,
+                 timeout = 2.0, prompt = b'>', terminator = '\r'):
+        """
+        Opens port. timeout is the longest time in seconds to wait for the
+        prompt after a command.
+        """
+        self.port = s.Serial(port = port, baudrate = BaudRate,
+                             bytesize = DataBits, stopbits = StopBits,
+                             timeout = 0.05)
+        self.timeout = timeout
+        self.prompt = prompt
+        self.terminator = terminator
+        self.lock = threading.Lock()
+        self.lastLatency = None
+        self.reader = None
+        self.stop = threading.Event()
+        self.lines = collections.deque(maxlen = 200)
+        self.replies = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Stops the reader thread and closes the port.
+        """
+        self.stopReader()
+        if self.port.is_open:
+            self.port.close()
+
+    def startReader(self):
+        """
+        Starts the background thread that drains the port.
+        """
+        if self.reader is not None:
+            return
+        self.stop.clear()
+        self.reader = threading.Thread(target = self.readLoop, daemon = True)
+        self.reader.start()
+
+    def stopReader(self):
+        """
+        Stops the background reader thread if it is running.
+        """
+        if self.reader is None:
+            return
+        self.stop.set()
+        self.reader.join()
+        self.reader = None
+
+    def readLoop(self):
+        """
+        Reader thread: splits incoming data into lines and hands the lines
+        received up to each prompt over as one reply.
+        """
+        partial = bytearray()
+        reply = []
+        while not self.stop.is_set():
+            try:
+                chunk = self.port.read(max(1, self.port.in_waiting))
+            except Exception as ex:
+                # port closed or unplugged, fail any waiting command
+                self.replies.put(ex)
+                return
+            if not chunk:
+                continue
+            partial += chunk
+            # complete lines end in a carriage return or a newline
+            while True:
+                ends = [i for i in (partial.find(b'\r'), partial.find(b'\n'))
+                        if i >= 0]
+                if not ends:
+                    break
+                line = partial[:min(ends)].decode('ascii', 'replace').strip()
+                del partial[:min(ends) + 1]
+                if line:
+                    self.lines.append((time.time(), line))
+                    reply.append(line)
+            # the prompt is not followed by a line end
+            if partial.strip() == self.prompt:
+                partial.clear()
+                self.replies.put(reply)
+                reply = []
+
+    def command(self, text, timeout = None):
+        """
+        Sends text terminated with a carriage return and waits for the
+        prompt. Returns the reply without the echoed command and prompt.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        start = time.perf_counter()
+        # wait for any command in progress, within the same timeout
+        if not self.lock.acquire(timeout = timeout):
+            raise TimeoutError('Laser port busy, could not send ' + text)
+        try:
+            if self.reader is not None:
+                # drop replies nobody waited for
+                while not self.replies.empty():
+                    self.replies.get_nowait()
+                self.port.write((text + self.terminator).encode('ascii'))
+                try:
+                    lines = self.replies.get(timeout = timeout)
+                except queue.Empty:
+                    raise TimeoutError('Laser did not answer ' + text)
+                if isinstance(lines, Exception):
+                    raise lines
+                reply = stripEcho(lines, text)
+            else:
+                # drop anything left over from an earlier command
+                self.port.reset_input_buffer()
+                self.port.write((text + self.terminator).encode('ascii'))
+                raw = self.readUntilPrompt(time.perf_counter() + timeout)
+                reply = parseReply(raw, text, self.prompt)
+            self.lastLatency = time.perf_counter() - start
+        finally:
+            self.lock.release()
+        return reply
+
+    def readUntilPrompt(self, deadline):
+        """
+        Reads from the port until the data ends with the prompt, raising a
+        TimeoutError at deadline.
+        """
+        data = bytearray()
+        while True:
+            # read everything waiting, or block briefly for the next byte
+            chunk = self.port.read(max(1, self.port.in_waiting))
+            if chunk:
+                data += chunk
+                if data.rstrip().endswith(self.prompt):
+                    return bytes(data)
+            if time.perf_counter() >= deadline:
+                raise TimeoutError('Laser did not answer, got ' +
+                                   repr(bytes(data)))
+
+
+def stripEcho(lines, text):
+    """
+    Returns the reply lines joined, without the echoed command text.
+    """
+    if lines and lines[0] == text:
+        lines = lines[1:]
+    return '\n'.join(lines)
+
+
+def parseReply(raw, text, prompt = b'>'):
+    """
+    Returns the reply in raw with the echoed command text and the trailing
+    prompt removed.
+    """
+    reply = raw.decode('ascii', 'replace').rstrip()
+    prompt = prompt.decode('ascii')
+    if reply.endswith(prompt):
+        reply = reply[:-len(prompt)]
+    lines = [line.strip() for line in reply.replace('\r', '\n').split('\n')]
+    return stripEcho([line for line in lines if line], text)
@@ -0,0 +1,147 @@
+# laserSimulator - a simulated laser source on a pseudo-terminal
+#
+# SimulatedLaser opens a pseudo-terminal and answers on it like the laser
+# source: every command is echoed, followed by any reply and the prompt.
+# It understands system=, enable=, channel=, current= and statword? (its
+# status word layout, statwordBits, is made up), keeps the state of the
+# four channels, and waits latency seconds (plus normally distributed
+# jitter) before every answer. LaserSession, and so Laser, can
+# be opened on SimulatedLaser.port like on the real serial port. Only
+# works where pseudo-terminals exist (Linux, macOS).
+#
+#Brief Usage:
+#    Start a simulated laser that answers after 10 +- 2 ms:
+#        sim = SimulatedLaser(latency = 0.01, jitter = 0.002)
+#        session = LaserSession(sim.port)
+#    Look at its state:
+#        sim.channels[2]['current'], sim.commands
+#        # commands counts the commands received
+#    Stop it:
+#        sim.close()
+
+import os
+import pty
+import random
+import threading
+import time
+import tty
+from laserCommands import maxCurrent
+
+# bit of the simulated status word: (channel or 'system', field). Made up
+# for the simulator, it is not the layout of the real laser source
+statwordBits = {0: ('system', 'enabled'),
+                1: ('system', 'interlock'),
+                2: (1, 'enabled'),
+                3: (2, 'enabled'),
+                4: (3, 'enabled'),
+                5: (4, 'enabled'),
+                6: (1, 'fault'),
+                7: (2, 'fault'),
+                8: (3, 'fault'),
+                9: (4, 'fault')}
+
+
+class SimulatedLaser:
+    """
+    A laser source simulated on a pseudo-terminal.
+    """
+
+    def __init__(self, latency = 0.01, jitter = 0.0, seed = None,
+                 prompt = b'> '):
+        """
+        Opens the pseudo-terminal and starts answering on it. port is the
+        device name to open the serial connection on.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.prompt = prompt
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.system = False
+        self.channel = 1
+        self.channels = dict((c, {'enabled': False, 'current': 0.0,
+                                  'fault': False}) for c in maxCurrent)
+        self.commands = 0
+        self.halt = threading.Event()
+        self.thread = threading.Thread(target = self.serve, daemon = True)
+        self.thread.start()
+
+    def close(self):
+        """
+        Stops answering and closes the pseudo-terminal.
+        """
+        self.halt.set()
+        os.close(self.master)
+        os.close(self.slave)
+        self.thread.join()
+
+    def serve(self):
+        """
+        Simulator thread: answers each command terminated by a carriage
+        return.
+        """
+        buffer = b''
+        while not self.halt.is_set():
+            try:
+                buffer += os.read(self.master, 256)
+            except OSError:
+                return
+            while b'\r' in buffer:
+                line, buffer = buffer.split(b'\r', 1)
+                text = line.decode('ascii', 'replace').strip()
+                reply = self.answer(text)
+                delay = self.latency + self.random.gauss(0, self.jitter)
+                time.sleep(max(0.0, delay))
+                out = line + b'\r'
+                if reply:
+                    out += reply.encode('ascii') + b'\r'
+                try:
+                    os.write(self.master, out + self.prompt)
+                except OSError:
+                    return
+
+    def statword(self):
+        """
+        Returns the status word of the simulated state.
+        """
+        word = 0
+        for bit, (owner, field) in statwordBits.items():
+            if owner == 'system':
+                value = {'enabled': self.system,
+                         'interlock': False}.get(field, False)
+            else:
+                value = self.channels[owner].get(field, False)
+            word |= int(bool(value)) << bit
+        return word
+
+    def answer(self, text):
+        """
+        Applies one command to the simulated state and returns its reply.
+        """
+        self.commands += 1
+        if text == 'statword?':
+            return str(self.statword())
+        if '=' not in text:
+            return 'CMD_NOT_DEFINED'
+        name, value = text.split('=', 1)
+        try:
+            number = float(value)
+        except ValueError:
+            return 'CMD_ARG_INVALID'
+        if name == 'system':
+            self.system = number == 1
+        elif name == 'channel':
+            if int(number) not in self.channels:
+                return 'CMD_ARG_INVALID'
+            self.channel = int(number)
+        elif name == 'enable':
+            self.channels[self.channel]['enabled'] = number == 1
+        elif name == 'current':
+            if number < 0 or number > maxCurrent[self.channel]:
+                return 'CMD_ARG_INVALID'
+            self.channels[self.channel]['current'] = number
+        else:
+            return 'CMD_NOT_DEFINED'
+        return ''
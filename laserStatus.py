@@ -0,0 +1,110 @@
+# laserStatus - keeps the latest status of the laser source at hand
+#
+# A StatusMonitor asks the laser for its status word every interval seconds
+# on a background thread and keeps the latest one, so supervisory code can
+# read the latest status without touching the serial port. A fresh status
+# can still be asked for, with a deadline.
+#
+# The status word is kept as the text the laser answers, as the old status
+# function returned it. Its bit layout is not decoded here: a parse
+# function can be given to decode it, with the layout taken from the manual
+# of the laser source.
+#
+#Brief Usage:
+#    Poll the laser in the background:
+#        monitor = StatusMonitor(session, interval = 5)
+#        monitor.start()
+#        status, age = monitor.latest()
+#        # age is the number of seconds since the status was read
+#        status = monitor.fresh(timeout = 1)
+#        monitor.stop()
+#    Keep decoded statuses instead, parse(reply) returning anything:
+#        monitor = StatusMonitor(session, parse = parse)
+
+import threading
+import time
+
+
+class StatusMonitor:
+    """
+    Reads the status of the laser on a background thread and keeps the
+    latest one.
+    """
+
+    def __init__(self, session, interval = 5.0, parse = None):
+        """
+        Creates a monitor that reads the status through session every
+        interval seconds. If parse is given, the status kept is
+        parse(reply) instead of the reply text.
+        """
+        self.session = session
+        self.interval = interval
+        self.parse = parse
+        self.status = None
+        self.time = None
+        self.error = None
+        self.lock = threading.Lock()
+        self.halt = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Starts polling the laser.
+        """
+        if self.thread is not None:
+            return
+        self.halt.clear()
+        self.thread = threading.Thread(target = self.poll, daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops polling the laser.
+        """
+        if self.thread is None:
+            return
+        self.halt.set()
+        self.thread.join()
+        self.thread = None
+
+    def poll(self):
+        """
+        Background thread: reads the status every interval seconds.
+        """
+        while not self.halt.is_set():
+            try:
+                self.read()
+            except Exception as ex:
+                # keep polling, the error is kept for whoever asks
+                self.error = ex
+            self.halt.wait(self.interval)
+
+    def read(self, timeout = None):
+        """
+        Reads the status now, and returns it.
+        """
+        status = self.session.command('statword?', timeout).strip()
+        if self.parse is not None:
+            status = self.parse(status)
+        with self.lock:
+            self.status = status
+            self.time = time.time()
+            self.error = None
+        return status
+
+    def latest(self):
+        """
+        Returns the latest status and its age in seconds, without waiting.
+        Returns (None, None) if no status has been read yet.
+        """
+        with self.lock:
+            if self.status is None:
+                return None, None
+            return self.status, time.time() - self.time
+
+    def fresh(self, timeout = 2.0):
+        """
+        Reads the status now and returns it, raising a TimeoutError if the
+        laser does not answer within timeout seconds.
+        """
+        return self.read(timeout)
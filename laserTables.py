@@ -0,0 +1,115 @@
+# laserTables - measured current to intensity tables of the laser channels
+#
+# sweep steps a channel through a grid of currents and measures the peak
+# intensity at each, stopping at the first saturated one. The result is an
+# IntensityTable, which is made monotone (a dimmer reading above a brighter
+# one is measurement noise) and interpolated linearly both ways, so the
+# current for a requested intensity is a lookup instead of trial and error.
+# LaserTables keeps the table of every channel in a json file (see
+# channelStore.py), with the time it was measured and the CCD temperature
+# during the sweep.
+#
+#Brief Usage:
+#    Measure channel 2, measure() returning the peak as a fraction of
+#    saturation after setCurrent(current) was called:
+#        table = sweep(setCurrent, measure, np.linspace(0, 63.89, 20),
+#                      ccdtemp = -40)
+#        tables = LaserTables('C:/Lab/FPWC/hardware/laserTables.json')
+#        tables.put(2, table)
+#    Look up the current giving 90% of saturation:
+#        current = tables.get(2).current(0.9)
+
+import time
+import numpy as np
+from channelStore import ChannelStore
+
+
+class IntensityTable:
+    """
+    Peak intensity of a laser channel measured on a grid of currents.
+    """
+
+    def __init__(self, currents, intensities, ccdtemp = None,
+                 created = None):
+        """
+        Creates the table from increasing currents and the intensities
+        measured at them.
+        """
+        order = np.argsort(currents)
+        self.currents = np.asarray(currents, np.float64)[order]
+        self.intensities = np.asarray(intensities, np.float64)[order]
+        self.ccdtemp = ccdtemp
+        self.created = time.time() if created is None else created
+        monotone = np.maximum.accumulate(self.intensities)
+        # keep the last current of every flat stretch, e.g. the threshold
+        keep = np.r_[np.diff(monotone) > 0, True]
+        self.monotoneCurrents = self.currents[keep]
+        self.monotoneIntensities = monotone[keep]
+
+    def intensity(self, current):
+        """
+        Returns the interpolated intensity at current.
+        """
+        return np.interp(current, self.monotoneCurrents,
+                         self.monotoneIntensities)
+
+    def current(self, intensity):
+        """
+        Returns the interpolated current giving intensity. Raises a
+        ValueError if intensity is above the brightest measured one.
+        """
+        if intensity > self.monotoneIntensities[-1]:
+            raise ValueError('Intensity ' + str(intensity) + ' is above the '
+                             'measured range, up to ' +
+                             str(self.monotoneIntensities[-1]))
+        return float(np.interp(intensity, self.monotoneIntensities,
+                               self.monotoneCurrents))
+
+    def toDict(self):
+        """
+        Returns the table as a dictionary that can be written to json.
+        """
+        return {'currents': self.currents.tolist(),
+                'intensities': self.intensities.tolist(),
+                'ccdtemp': self.ccdtemp, 'created': self.created}
+
+    @classmethod
+    def fromDict(cls, values):
+        """
+        Creates a table from a dictionary written by toDict.
+        """
+        return cls(values['currents'], values['intensities'],
+                   values['ccdtemp'], values['created'])
+
+
+def sweep(setCurrent, measure, currents, ccdtemp = None, saturation = 1.0):
+    """
+    Calls setCurrent(current) and measure() for the currents in
+    increasing order, stopping after the first measurement at or above
+    saturation, and returns the IntensityTable of the measurements below
+    saturation.
+    """
+    measured = []
+    intensities = []
+    for current in np.sort(currents):
+        setCurrent(float(current))
+        intensity = measure()
+        if intensity >= saturation:
+            break
+        measured.append(float(current))
+        intensities.append(intensity)
+    if not measured:
+        raise ValueError('Saturated at the lowest current of the sweep')
+    return IntensityTable(measured, intensities, ccdtemp)
+
+
+class LaserTables(ChannelStore):
+    """
+    The intensity tables of the laser channels, stored in a json file.
+    """
+
+    def __init__(self, path):
+        """
+        Reads the tables stored in path, if it exists.
+        """
+        ChannelStore.__init__(self, path, IntensityTable.fromDict)
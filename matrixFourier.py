@@ -0,0 +1,105 @@
+# matrixFourier - evaluates the focal plane of a pupil only where it is used
+#
+# The laser calibration pads the (transposed) pupil image to N x N, takes
+#     abs(fftshift(fft2(fftshift(largeImage))))
+# and normalizes it by its maximum, but then only reads two small windows.
+# With the pupil of size x by y placed at rows r0 = int((N - x) / 2) and
+# columns c0 = int((N - y) / 2), the value at focal plane pixel (u, v) is
+#     sum_jk image[j, k] exp(-2 pi i (u - N/2) (r0 + j + N/2) / N)
+#                        exp(-2 pi i (v - N/2) (c0 + k + N/2) / N)
+# which is the matrix product Mr @ image @ Mc.T, evaluated here for just
+# the requested rows and columns (matrix Fourier transform). u and v may
+# be fractional, which samples the focal plane more finely than the FFT.
+#
+# The FFT image is normalized by its maximum over the whole plane. For a
+# pupil with no negative values that maximum is the zero frequency term,
+# abs(sum(image)), which is what is used here unless norm is given.
+#
+#Brief Usage:
+#    Evaluate the normalized focal plane on some rows and columns:
+#        window = focalWindow(image, N, rows, cols)
+#        # equals Fourier[rows][:, cols] of the padded FFT
+#    Use the focal plane like the padded FFT image, computing only slices:
+#        Fourier = FocalPlane(image, N)
+#        centerPat = Fourier[2015:2085, 2015:2085]
+
+import numpy as np
+
+
+def dftMatrix(coords, n, start, N):
+    """
+    Returns the len(coords) x n matrix taking n pupil samples placed from
+    index start of an N point padded array to the shifted focal plane
+    coordinates coords.
+    """
+    coords = np.asarray(coords, np.float64)
+    samples = start + np.arange(n) + N // 2
+    return np.exp((-2j * np.pi / N) * np.outer(coords - N // 2, samples))
+
+
+def focalField(image, N, rows, cols):
+    """
+    Returns the complex focal plane field of image padded to N x N at the
+    given rows and columns of the shifted FFT.
+    """
+    image = np.asarray(image)
+    x, y = image.shape
+    if x > N or y > N:
+        raise ValueError('Pupil image is larger than the padded size')
+    mr = dftMatrix(rows, x, int((N - x) / 2), N)
+    mc = dftMatrix(cols, y, int((N - y) / 2), N)
+    # contract along the shorter side first
+    if len(rows) * y <= len(cols) * x:
+        return (mr @ image) @ mc.T
+    return mr @ (image @ mc.T)
+
+
+def focalWindow(image, N, rows, cols, norm = None):
+    """
+    Returns abs of the focal field at rows and columns divided by norm,
+    which defaults to abs(sum(image)), the peak for non-negative pupils.
+    """
+    if norm is None:
+        norm = abs(np.sum(image))
+    return np.abs(focalField(image, N, rows, cols)) / norm
+
+
+class FocalPlane:
+    """
+    Stands in for the normalized padded FFT image of a pupil. Slicing it
+    computes only the slice.
+    """
+
+    def __init__(self, image, N, norm = None):
+        """
+        Creates the focal plane of image padded to N x N.
+        """
+        self.image = np.asarray(image, np.float64)
+        self.N = N
+        self.shape = (N, N)
+        self.norm = abs(np.sum(self.image)) if norm is None else norm
+
+    def indices(self, key):
+        """
+        Turns one index or slice into an array of focal plane indices.
+        """
+        if isinstance(key, slice):
+            return np.arange(self.N)[key]
+        return np.atleast_1d(np.asarray(key)) % self.N
+
+    def __getitem__(self, key):
+        """
+        Returns the normalized magnitude of the focal plane at key, a pair
+        of indices or slices.
+        """
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        rows = self.indices(key[0])
+        cols = self.indices(key[1])
+        window = focalWindow(self.image, self.N, rows, cols, self.norm)
+        # single indices drop their dimension like for arrays
+        if not isinstance(key[1], slice) and np.ndim(key[1]) == 0:
+            window = window[:, 0]
+        if not isinstance(key[0], slice) and np.ndim(key[0]) == 0:
+            window = window[0]
+        return window
@@ -0,0 +1,193 @@
+# peakFitting - fits Gaussian peaks to batches of image windows
+#
+# The default estimator is closed form: the brightest pixel of each window
+# and its four neighbours are fitted with a parabola in log intensity, which
+# is exact for a Gaussian peak. That gives the sub-pixel position, the width
+# along x and y and the height without any iteration, for all the windows
+# of a batch at once. Windows of different sizes are grouped by shape and
+# each group is fitted in one vectorized pass. With refine = True every
+# window is then fitted with a 2D Gaussian plus offset by least squares,
+# seeded from the closed form estimate (needs scipy).
+#
+# Parameters are returned per window as (height, x, y, widthX, widthY), x
+# being the column and y the row inside the window, like fit_gauss_2D.
+#
+# findLobes locates the central and secondary lobes of a focal plane image
+# (an array or a FocalPlane) at any size N by searching every N / samples
+# pixels only, so the windows to fit can be placed without knowing the
+# sampling in advance.
+#
+#Brief Usage:
+#    Fit the peaks of two windows:
+#        params = fitPeaks([centerPat, secondaryPat])
+#        height, x, y, widthX, widthY = params[0]
+#    Refine them with a least squares fit:
+#        params = fitPeaks([centerPat, secondaryPat], refine = True)
+#    Find the lobes of a focal plane, ignoring 40 pixels around the center
+#    for the secondary one:
+#        (cx, cy), (sx, sy) = findLobes(Fourier, N, 40)
+#    Or get the points and window sizes the calibration fits:
+#        cPoint, sPoint, cSize, sSize = lobeWindows(Fourier, N)
+#        params = fitLobes(Fourier, cPoint, sPoint, cSize, sSize)
+
+import numpy as np
+
+# floor for the logarithm of dark pixels
+tiny = 1e-300
+
+
+def logParabola(left, middle, right):
+    """
+    Returns the sub-pixel offset from middle, the squared width and the
+    log height correction of parabolas through the log intensities left,
+    middle and right (arrays). Flat or upward curvature gives offset 0 and
+    infinite width.
+    """
+    curvature = left - 2 * middle + right
+    peaked = curvature < 0
+    safe = np.where(peaked, curvature, -1.0)
+    offset = np.where(peaked, 0.5 * (left - right) / safe, 0.0)
+    # the true peak is within half a pixel of the brightest one
+    offset = np.clip(offset, -0.5, 0.5)
+    width2 = np.where(peaked, -1.0 / safe, np.inf)
+    correction = np.where(peaked, -0.125 * (left - right) ** 2 / safe, 0.0)
+    return offset, width2, correction
+
+
+def estimatePeaks(windows):
+    """
+    Returns the closed form (height, x, y, widthX, widthY) of the peak of
+    each window in windows, a k x h x w array, as a k x 5 array.
+    """
+    windows = np.asarray(windows, np.float64)
+    k, h, w = windows.shape
+    flat = windows.reshape(k, -1).argmax(axis = 1)
+    # keep the 3 x 3 neighbourhood inside the window
+    row = np.clip(flat // w, 1, h - 2) if h > 2 else np.zeros(k, int)
+    col = np.clip(flat % w, 1, w - 2) if w > 2 else np.zeros(k, int)
+    index = np.arange(k)
+    logs = np.log(np.maximum(windows, tiny))
+    middle = logs[index, row, col]
+    params = np.empty((k, 5))
+    if w > 2:
+        dx, wx2, cx = logParabola(logs[index, row, col - 1], middle,
+                                  logs[index, row, col + 1])
+    else:
+        dx, wx2, cx = np.zeros(k), np.full(k, np.inf), np.zeros(k)
+    if h > 2:
+        dy, wy2, cy = logParabola(logs[index, row - 1, col], middle,
+                                  logs[index, row + 1, col])
+    else:
+        dy, wy2, cy = np.zeros(k), np.full(k, np.inf), np.zeros(k)
+    params[:, 0] = np.exp(middle + cx + cy)
+    params[:, 1] = col + dx
+    params[:, 2] = row + dy
+    params[:, 3] = np.sqrt(wx2)
+    params[:, 4] = np.sqrt(wy2)
+    return params
+
+
+def gaussian(params, x, y):
+    """
+    Returns a 2D Gaussian of (height, x0, y0, widthX, widthY, offset)
+    evaluated at x and y.
+    """
+    height, x0, y0, widthX, widthY, offset = params
+    return offset + height * np.exp(-0.5 * (((x - x0) / widthX) ** 2 +
+                                            ((y - y0) / widthY) ** 2))
+
+
+def refinePeak(window, estimate):
+    """
+    Fits a 2D Gaussian plus offset to window by least squares, starting
+    from the (height, x, y, widthX, widthY) estimate, and returns the
+    fitted (height, x, y, widthX, widthY).
+    """
+    from scipy.optimize import least_squares
+    window = np.asarray(window, np.float64)
+    y, x = np.indices(window.shape)
+    h, w = window.shape
+    # an infinite width from a flat neighbourhood starts at the window size
+    widths = [min(s, size) for s, size in zip(estimate[3:5], (w, h))]
+    start = np.concatenate([estimate[:3], widths, [0.0]])
+    fit = least_squares(lambda p: (gaussian(p, x, y) - window).ravel(),
+                        start, x_scale = 'jac')
+    height, x0, y0, widthX, widthY, offset = fit.x
+    return np.array([height, x0, y0, abs(widthX), abs(widthY)])
+
+
+def fitPeaks(windows, refine = False):
+    """
+    Fits the peak of every window in windows, a list of 2D arrays or a
+    k x h x w array, and returns a k x 5 array of (height, x, y, widthX,
+    widthY). If refine is True the closed form estimates seed a least
+    squares fit of each window.
+    """
+    if isinstance(windows, np.ndarray) and windows.ndim == 3:
+        params = estimatePeaks(windows)
+    else:
+        windows = [np.asarray(window, np.float64) for window in windows]
+        params = np.empty((len(windows), 5))
+        # one vectorized pass per window size
+        shapes = {}
+        for i, window in enumerate(windows):
+            shapes.setdefault(window.shape, []).append(i)
+        for shape, indices in shapes.items():
+            params[indices] = estimatePeaks(np.stack([windows[i]
+                                                      for i in indices]))
+    if refine:
+        for i in range(len(params)):
+            params[i] = refinePeak(windows[i], params[i])
+    return params
+
+
+def findLobes(Fourier, N, exclude, samples = 512):
+    """
+    Returns the (x, y) focal plane coordinates of the brightest point of
+    Fourier, an N x N array or FocalPlane, and of the brightest point more
+    than exclude pixels away from it. Only every N / samples pixel is
+    looked at, so the coordinates are within that many pixels.
+    """
+    step = max(1, N // samples)
+    coarse = np.asarray(Fourier[::step, ::step])
+    row, col = np.unravel_index(coarse.argmax(), coarse.shape)
+    rows, cols = np.indices(coarse.shape)
+    far = ((rows - row) ** 2 + (cols - col) ** 2) * step ** 2 > exclude ** 2
+    if not far.any():
+        raise ValueError('No secondary lobe outside the excluded radius')
+    masked = np.where(far, coarse, -np.inf)
+    secondRow, secondCol = np.unravel_index(masked.argmax(), coarse.shape)
+    return ((int(col * step), int(row * step)),
+            (int(secondCol * step), int(secondRow * step)))
+
+
+def lobeWindows(Fourier, N):
+    """
+    Returns the center point, secondary point, center window size and
+    secondary window size to fit in the N x N Fourier image. The sizes
+    are those that worked at N = 2048, scaled with N.
+    """
+    cSize = max(8, int(N * 85 / 2048))
+    sSize = max(8, int(N * 34 / 2048))
+    cPoint, sPoint = findLobes(Fourier, N, cSize / 2)
+    return cPoint, sPoint, cSize, sSize
+
+
+def fitLobes(Fourier, cPoint, sPoint, cSize, sSize, refine = False):
+    """
+    Crops the cSize and sSize square windows around the (x, y) points
+    cPoint and sPoint out of Fourier, like gaussManual, and fits both
+    peaks. Returns a 2 x 5 array of (height, x, y, widthX, widthY) with x
+    and y in the coordinates of Fourier.
+    """
+    windows = []
+    starts = []
+    for point, size in ((cPoint, cSize), (sPoint, sSize)):
+        x0, x1 = int(point[0] - size / 2), int(point[0] + size / 2)
+        y0, y1 = int(point[1] - size / 2), int(point[1] + size / 2)
+        # the y-coordinate is cropped first
+        windows.append(Fourier[y0:y1, x0:x1])
+        starts.append((x0, y0))
+    params = fitPeaks(windows, refine)
+    params[:, 1:3] += starts
+    return params
@@ -0,0 +1,97 @@
+# realtimeViewer - fast live display of camera frames
+#
+# Frames are taken on the calling thread, since the camera is a COM object
+# that belongs to the thread that created it, and decimated to at most
+# maxPixels on a side right away, which copies them out of the camera's
+# frame ring before it is reused. The display reuses one image artist and
+# blits only the axes, so the cost of a redraw stays the same however long
+# the viewer runs and the next exposure starts almost at once. The achieved
+# frame rate and the latency from the end of readout to the frame being
+# drawn are shown in the corner of the image.
+#
+#Brief Usage:
+#    Show frames until the figure is closed:
+#        viewer = RealtimeViewer(lambda: camera.exposure(0.0003))
+#        viewer.run()
+#    Show at most 256 pixels on a side in figure 5:
+#        viewer = RealtimeViewer(acquire, figNum = 5, maxPixels = 256)
+#        # viewer.fps and viewer.latency hold the last measured values
+
+import time
+import numpy as np
+from matplotlib import pyplot as plt
+
+
+def decimate(frame, maxPixels):
+    """
+    Returns a copy of frame keeping every n-th row and column, with n the
+    smallest step that brings both sides to at most maxPixels.
+    """
+    step = max(1, int(np.ceil(max(np.shape(frame)) / float(maxPixels))))
+    return np.array(frame[::step, ::step], np.float32)
+
+
+class RealtimeViewer:
+    """
+    A live view of camera frames that redraws with blitting.
+    """
+
+    def __init__(self, acquire, figNum = 100, maxPixels = 512,
+                 title = 'Real Time Picture'):
+        """
+        acquire() returns the next frame. It is called on the thread that
+        calls run for as long as the figure is open.
+        """
+        self.acquire = acquire
+        self.figNum = figNum
+        self.maxPixels = maxPixels
+        self.title = title
+        self.fps = 0.0
+        self.latency = 0.0
+
+    def run(self):
+        """
+        Acquires and displays frames until the figure is closed. Errors
+        from acquire are raised as they happen.
+        """
+        fig = plt.figure(self.figNum)
+        fig.clf()
+        ax = fig.add_subplot(111)
+        ax.set_title(self.title)
+        image = None
+        text = ax.text(0.02, 0.98, '', transform = ax.transAxes,
+                       va = 'top', color = 'w', animated = True)
+        background = [None]
+
+        def saveBackground(event):
+            # the figure was redrawn (e.g. resized), so grab a new background
+            background[0] = fig.canvas.copy_from_bbox(ax.bbox)
+            if image is not None:
+                ax.draw_artist(image)
+            ax.draw_artist(text)
+
+        fig.canvas.mpl_connect('draw_event', saveBackground)
+        plt.show(block = False)
+        shown = 0
+        start = time.perf_counter()
+        while plt.fignum_exists(self.figNum):
+            frame = decimate(self.acquire(), self.maxPixels)
+            readout = time.perf_counter()
+            if image is None or image.get_array().shape != frame.shape:
+                # first frame or new frame size: make the one artist
+                if image is not None:
+                    image.remove()
+                image = ax.imshow(frame, animated = True)
+                fig.canvas.draw()
+            image.set_data(frame)
+            image.set_clim(frame.min(), frame.max())
+            shown += 1
+            self.fps = shown / (time.perf_counter() - start)
+            self.latency = time.perf_counter() - readout
+            text.set_text('%.1f fps  %.0f ms' % (self.fps,
+                                                1000 * self.latency))
+            fig.canvas.restore_region(background[0])
+            ax.draw_artist(image)
+            ax.draw_artist(text)
+            fig.canvas.blit(ax.bbox)
+            fig.canvas.flush_events()
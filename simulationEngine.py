@@ -0,0 +1,258 @@
+# simulationEngine - simulated camera images of the coronagraph for given
+#   DM commands
+#
+# The DM surfaces are sums of Gaussian influence functions, one per
+# actuator, whose value at the neighbouring actuators is DM.coupling. A
+# Gaussian is separable, so the surface of a command grid C is G C G.T with
+# G the Npupil x Nact influence matrix, computed once. The pupil field is
+#     exp(2i k (h1 + h2)) * pupil
+# with h the surfaces in meters (volts times DM.VtoH), pupil the shaped
+# pupil (coronagraph.SPshape) and k the wavenumber. If DM.zDM is not 0,
+# DM2 is that far from the pupil, and the field is propagated to it and
+# back with a cached angular spectrum transfer function, on a grid zero
+# padded by 2 that is only cropped after coming back, so the round trip
+# is exact. The camera field is a matrix Fourier transform of the pupil
+# field onto the Nxi x Neta camera pixels, camera.sampling pixels per
+# lambda/D. coronagraph.FPmask, if given, is a field stop: it multiplies
+# the field in the camera plane, there is no intermediate focal plane, as
+# with a shaped pupil coronagraph. The image is the intensity divided by
+# the peak of the image of flat DMs without the field stop, computed
+# through the same propagation (contrast). Everything works on batches of
+# commands at once.
+#
+# addCameraNoise turns contrast images into noisy ones: photon noise of the
+# star (target.flux counts per second at the peak) and of the dark current,
+# and Gaussian read noise, returned in contrast units with the mean dark
+# subtracted like the lab images.
+#
+# Attributes read, with their defaults:
+#     DM: Nact, activeActIndex, VtoH (1e-9 m/V, scalar or Nact x Nact),
+#         coupling (0.15), zDM (0), pitch (301e-6 m)
+#     coronagraph: SPshape (open circular pupil of 2 * Nact pixels), FPmask
+#         (field stop on the camera pixels, none by default)
+#     target: starWavelength (650e-9 m), flux (1e10 counts/s)
+#     camera: Nxi, Neta, sampling (4), exposure, readoutstd (12 counts),
+#         darkCurrent (0.01 counts/s), noise (False)
+#
+#Brief Usage:
+#    Get the engine of a setup, built on first use and kept on coronagraph,
+#    and rebuilt when an attribute it uses changes, arrays edited in place
+#    included:
+#        engine = simulationEngine(target, DM, coronagraph, camera)
+#    Contrast image of one command, or k images of k x nActive commands:
+#        I = engine.image(DM1command, DM2command)
+#        I = engine.image(DM1commands, DM2commands)
+#    Add camera noise:
+#        I = addCameraNoise(I, target.flux * camera.exposure)
+
+import numpy as np
+from dmGeometry import indexCopy, sameIndex
+
+
+def influenceMatrix(Nact, Npupil, coupling = 0.15):
+    """
+    Returns the Npupil x Nact matrix of the 1D Gaussian influence function
+    of every actuator across the pupil, equal to coupling one actuator
+    away.
+    """
+    pitch = Npupil / Nact
+    width = pitch / np.sqrt(-2 * np.log(coupling))
+    x = np.arange(Npupil) + 0.5
+    centers = (np.arange(Nact) + 0.5) * pitch
+    return np.exp(-0.5 * ((x[:, None] - centers[None, :]) / width) ** 2)
+
+
+def mftMatrix(Nfocal, Npupil, sampling):
+    """
+    Returns the Nfocal x Npupil matrix taking a pupil of Npupil samples
+    across D to Nfocal focal plane pixels, sampling pixels per lambda/D,
+    centered on pixel Nfocal // 2.
+    """
+    x = (np.arange(Npupil) - Npupil / 2 + 0.5) / Npupil
+    xi = (np.arange(Nfocal) - Nfocal // 2) / sampling
+    return np.exp(-2j * np.pi * np.outer(xi, x)) / Npupil
+
+
+def circularPupil(Npupil):
+    """
+    Returns an open circular pupil filling an Npupil x Npupil array.
+    """
+    x = np.arange(Npupil) - Npupil / 2 + 0.5
+    return (x[:, None] ** 2 + x[None, :] ** 2 <= (Npupil / 2) ** 2) * 1.0
+
+
+class SimulationEngine:
+    """
+    Simulated coronagraph images of DM commands, with every operator that
+    does not depend on the commands computed once.
+    """
+
+    def __init__(self, Nact, activeActIndex, pupil, Nxi, Neta,
+                 sampling = 4.0, wavelength = 650e-9, VtoH = 1e-9,
+                 coupling = 0.15, zDM = 0.0, pitch = 301e-6,
+                 FPmask = None):
+        """
+        Builds the operators for an Nact x Nact DM pair with the active
+        actuators activeActIndex, the pupil amplitude pupil (Npupil x
+        Npupil, spanning the DM) and an Nxi x Neta camera.
+        """
+        self.Nact = Nact
+        self.pupil = np.asarray(pupil, np.float64)
+        Npupil = self.pupil.shape[0]
+        self.wavenumber = 2 * np.pi / wavelength
+        # flat positions of the active actuators in the Nact x Nact grid
+        self.positions = np.arange(Nact * Nact).reshape(Nact, Nact)[
+                activeActIndex]
+        self.nActive = self.positions.size
+        VtoH = np.asarray(VtoH, np.float64)
+        self.VtoH = VtoH[activeActIndex] if VtoH.ndim == 2 else VtoH
+        self.influence = influenceMatrix(Nact, Npupil, coupling)
+        self.rows = mftMatrix(Nxi, Npupil, sampling)
+        self.cols = mftMatrix(Neta, Npupil, sampling)
+        self.FPmask = None
+        self.transfer = None
+        if zDM:
+            # angular spectrum propagation over zDM on a grid padded by 2
+            dx = pitch * Nact / Npupil
+            f = np.fft.fftfreq(2 * Npupil, dx)
+            f2 = f[:, None] ** 2 + f[None, :] ** 2
+            self.transfer = np.exp(-1j * np.pi * wavelength * zDM * f2)
+        # the peak of the image of flat DMs, through the same propagation
+        # and without the field stop
+        self.peak = 1.0
+        flat = np.zeros(self.nActive)
+        self.peak = self.image(flat, flat)[Nxi // 2, Neta // 2]
+        self.FPmask = None if FPmask is None else np.asarray(FPmask)
+
+    def surface(self, commands):
+        """
+        Returns the surface heights in meters of the DM commands (volts,
+        k x nActive or nActive), k x Npupil x Npupil.
+        """
+        commands = np.atleast_2d(commands)
+        grid = np.zeros((len(commands), self.Nact * self.Nact))
+        grid[:, self.positions] = commands * self.VtoH
+        grid = grid.reshape(-1, self.Nact, self.Nact)
+        return self.influence @ grid @ self.influence.T
+
+    def propagate(self, field, transfer):
+        """
+        Propagates k fields on the padded grid by the transfer function.
+        """
+        return np.fft.ifft2(np.fft.fft2(field) * transfer)
+
+    def pad(self, field, value):
+        """
+        Returns k n x n fields in the corner of 2n x 2n arrays of value.
+        """
+        n = field.shape[-1]
+        padded = np.full(field.shape[:-2] + (2 * n, 2 * n), value, complex)
+        padded[..., :n, :n] = field
+        return padded
+
+    def field(self, DM1commands, DM2commands):
+        """
+        Returns the camera fields of batches of DM1 and DM2 commands.
+        """
+        phase1 = np.exp(2j * self.wavenumber * self.surface(DM1commands))
+        phase2 = np.exp(2j * self.wavenumber * self.surface(DM2commands))
+        if self.transfer is None:
+            pupilField = phase1 * phase2
+        else:
+            # outside the DM area DM2 leaves the field alone; the field is
+            # only cropped back once it is in the pupil again
+            n = phase1.shape[-1]
+            pupilField = self.propagate(self.pad(phase1, 0), self.transfer)
+            pupilField *= self.pad(phase2, 1)
+            pupilField = self.propagate(pupilField, np.conj(self.transfer))
+            pupilField = pupilField[..., :n, :n]
+        pupilField = pupilField * self.pupil
+        focalField = self.rows @ pupilField @ self.cols.T
+        if self.FPmask is not None:
+            focalField = focalField * self.FPmask
+        return focalField
+
+    def image(self, DM1command, DM2command):
+        """
+        Returns the contrast image of the DM commands, or k images if the
+        commands are k x nActive batches.
+        """
+        single = np.ndim(DM1command) == 1 and np.ndim(DM2command) == 1
+        I = np.abs(self.field(DM1command, DM2command)) ** 2 / self.peak
+        return I[0] if single else I
+
+
+def addCameraNoise(I, counts, readNoise = 12.0, dark = 0.01, rng = None):
+    """
+    Returns contrast images I with photon, dark current and read noise,
+    counts being the counts of the peak (flux times exposure time) and
+    dark the dark counts per pixel. The mean dark is subtracted.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    signal = rng.poisson(np.maximum(I, 0) * counts + dark).astype(np.float64)
+    signal += rng.normal(0.0, readNoise, np.shape(I))
+    return (signal - dark) / counts
+
+
+def engineKey(target, DM, coronagraph, camera):
+    """
+    Returns what the engine of a setup is built from, to tell when it has
+    to be rebuilt.
+    """
+    return (DM.Nact, DM.activeActIndex, getattr(DM, 'VtoH', 1e-9),
+            getattr(DM, 'coupling', 0.15), getattr(DM, 'zDM', 0.0),
+            getattr(DM, 'pitch', 301e-6),
+            getattr(coronagraph, 'SPshape', None),
+            getattr(coronagraph, 'FPmask', None),
+            getattr(target, 'starWavelength', 650e-9),
+            camera.Nxi, camera.Neta, getattr(camera, 'sampling', 4.0))
+
+
+def isArray(value):
+    """
+    Returns True if value is an array or a tuple of arrays.
+    """
+    return isinstance(value, (np.ndarray, tuple))
+
+
+def keyCopy(key):
+    """
+    Returns key with copies of its arrays, which later changes to the
+    setup's arrays do not reach.
+    """
+    return tuple(indexCopy(value) if isArray(value) else value
+                 for value in key)
+
+
+def sameKey(key, other):
+    """
+    Returns True if two engine keys are the same, comparing arrays by
+    their values, so arrays edited in place are noticed too.
+    """
+    return all(sameIndex(a, b) if isArray(a) or isArray(b) else a == b
+               for a, b in zip(key, other))
+
+
+def simulationEngine(target, DM, coronagraph, camera):
+    """
+    Returns the SimulationEngine of the setup, building it only when one
+    of the attributes it is built from has changed since the last call.
+    """
+    key = engineKey(target, DM, coronagraph, camera)
+    engine = getattr(coronagraph, 'engine', None)
+    if engine is None or not sameKey(engine.key, key):
+        pupil = getattr(coronagraph, 'SPshape', None)
+        if pupil is None:
+            pupil = circularPupil(2 * DM.Nact)
+        engine = SimulationEngine(DM.Nact, DM.activeActIndex, pupil,
+                                  camera.Nxi, camera.Neta,
+                                  getattr(camera, 'sampling', 4.0),
+                                  getattr(target, 'starWavelength', 650e-9),
+                                  getattr(DM, 'VtoH', 1e-9),
+                                  getattr(DM, 'coupling', 0.15),
+                                  getattr(DM, 'zDM', 0.0),
+                                  getattr(DM, 'pitch', 301e-6),
+                                  getattr(coronagraph, 'FPmask', None))
+        engine.key = keyCopy(key)
+        coronagraph.engine = engine
+    return engine